@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""用vim --startuptime测量插件对Vim启动时间的影响
+
+    python bench/bench_startup.py --runs 10 [--cwd 项目目录]
+
+分别统计sourcing plugin/vimproject.vim和执行VimEnter自动命令（查找项目文件）的耗时。
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+REPO = Path(__file__).absolute().parent.parent
+
+
+def parse_startuptime(fname):
+    """返回(插件sourcing耗时, VimEnter耗时)，单位毫秒"""
+    source = enter = 0.0
+    with open(fname, encoding='utf-8', errors='replace') as fp:
+        for line in fp:
+            m = re.match(r'\s*[\d.]+\s+([\d.]+)\s+([\d.]+)?:?\s*(.*)', line)
+            if not m:
+                continue
+            if 'vimproject.vim' in m.group(3) and 'sourcing' in m.group(3):
+                # sourcing行为"时钟 自身+子项 自身: sourcing 文件"
+                source += float(m.group(1))
+            elif 'VimEnter' in m.group(3):
+                enter += float(m.group(1))
+    return source, enter
+
+
+def run_once(vim, cwd):
+    with tempfile.NamedTemporaryFile(suffix='.log', delete=False) as fp:
+        log = fp.name
+    try:
+        subprocess.run([vim, '-u', 'NONE', '-N', '-i', 'NONE', '-es',
+                        '--cmd', 'set rtp^=' + str(REPO),
+                        '--cmd', 'runtime plugin/vimproject.vim',
+                        '--startuptime', log, '-c', 'qa!'],
+                       cwd=cwd, stdin=subprocess.DEVNULL, check=False)
+        return parse_startuptime(log)
+    finally:
+        os.remove(log)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vim', default='vim')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--cwd', default=os.getcwd(), help='directory vim is started in')
+    args = parser.parse_args()
+
+    results = [run_once(args.vim, args.cwd) for _ in range(args.runs)]
+    for i, name in enumerate(['sourcing', 'VimEnter']):
+        times = [r[i] for r in results]
+        print('%-9s median %7.2fms  min %7.2fms  max %7.2fms' %
+              (name, statistics.median(times), min(times), max(times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""在生成的项目上测量查找、替换、收集文件和编码转换的性能
+
+    python bench/bench_suite.py --files 20000 --json new.json --compare old.json
+    python bench/bench_suite.py --dir 已有的项目目录 --only find
+
+不需要Vim，vim模块由fakevim代替。每项取--repeat次中最快的一次，
+峰值内存用tracemalloc另外运行一次测得，只包括主进程中Python分配的内存。
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).absolute().parent
+sys.path.insert(0, str(BENCH_DIR.parent / 'plugin'))
+sys.path.insert(0, str(BENCH_DIR))
+
+import fakevim
+fakevim.install()
+
+import gentree
+import findrep
+import vimrecoding
+from projfiles import walk_files
+
+BENCHMARKS = []
+
+
+def benchmark(name, setup=None):
+    """注册一项测试，函数返回(处理的文件数, 处理的字节数)"""
+
+    def decorator(func):
+        BENCHMARKS.append((name, func, setup))
+        return func
+
+    return decorator
+
+
+class Context(object):
+    def __init__(self, root, workers):
+        self.root = root
+        self.workers = workers
+        self.executor = None
+        self.project = None
+        self.files = []
+        self.bytes = 0
+        self.replace_from, self.replace_to = 'foo_bar', 'foo_baz'
+        self.recode_dir = None
+
+    def open_project(self):
+        import vimproject
+        self.project = vimproject.g_vimproject
+        self.project.from_file(os.path.join(self.root, 'bench.vprj'))
+        self.project.refresh_files()
+        self.files = list(self.project.files)
+        self.bytes = sum(os.path.getsize(f) for f in self.files)
+
+    def get_executor(self):
+        if self.executor is None and self.workers > 1:
+            self.executor = findrep.make_executor(self.workers)
+        return self.executor
+
+    def close(self):
+        if self.replace_from != 'foo_bar':
+            # 恢复被替换的文件
+            bench_replace(self)
+        if self.executor:
+            self.executor.shutdown()
+        if self.recode_dir:
+            shutil.rmtree(self.recode_dir, ignore_errors=True)
+        if self.project and self.project.projectfile:
+            # 文件列表等临时文件
+            shutil.rmtree(str(self.project.tempdir), ignore_errors=True)
+
+
+@benchmark('walk_files')
+def bench_walk(ctx):
+    prj = ctx.project
+    n = sum(1 for _ in walk_files(prj.make_filter()))
+    return n, 0
+
+
+@benchmark('refresh_files')
+def bench_refresh(ctx):
+    ctx.project.refresh_files()
+    return len(ctx.project.files), 0
+
+
+def _find(ctx, pattern, executor=None):
+    for _ in findrep.find_pattern(ctx.files, pattern, ctx.project.encoding, executor):
+        pass
+    return len(ctx.files), ctx.bytes
+
+
+@benchmark('find_literal')
+def bench_find_literal(ctx):
+    return _find(ctx, 'foo_bar')
+
+
+@benchmark('find_rare_literal')
+def bench_find_rare(ctx):
+    return _find(ctx, 'func_99')
+
+
+@benchmark('find_regex')
+def bench_find_regex(ctx):
+    return _find(ctx, r'\b(count|index)\s*=\s*\w+\(')
+
+
+@benchmark('find_nonascii')
+def bench_find_nonascii(ctx):
+    return _find(ctx, '缓冲区')
+
+
+@benchmark('find_literal_parallel')
+def bench_find_parallel(ctx):
+    executor = ctx.get_executor()
+    if executor is None:
+        return None
+    return _find(ctx, 'foo_bar', executor)
+
+
+@benchmark('replace')
+def bench_replace(ctx):
+    for _ in findrep.replace_pattern(ctx.files, ctx.replace_from, ctx.replace_to, ctx.project.encoding):
+        pass
+    # 下一次换回来，每次都有实际的替换
+    ctx.replace_from, ctx.replace_to = ctx.replace_to, ctx.replace_from
+    return len(ctx.files), ctx.bytes
+
+
+@benchmark('guess_encoding')
+def bench_guess(ctx):
+    for fname in ctx.files:
+        with open(fname, 'rb') as fp:
+            vimrecoding.guess_encoding(fp.read())
+    return len(ctx.files), ctx.bytes
+
+
+@benchmark('recode_stream')
+def bench_recode_stream(ctx):
+    # 所有文件连起来当作一个混合编码的输出流
+    recoder = vimrecoding.StreamRecoder('utf-8')
+    for fname in ctx.files:
+        with open(fname, 'rb') as fp:
+            recoder.recode(fp.read())
+    recoder.recode(b'', True)
+    return len(ctx.files), ctx.bytes
+
+
+def _copy_for_recode(ctx):
+    if ctx.recode_dir:
+        shutil.rmtree(ctx.recode_dir, ignore_errors=True)
+    ctx.recode_dir = tempfile.mkdtemp(prefix='vpbench')
+    ctx.recode_files = []
+    for i, fname in enumerate(ctx.files):
+        dst = os.path.join(ctx.recode_dir, '%d%s' % (i, os.path.splitext(fname)[1]))
+        shutil.copyfile(fname, dst)
+        ctx.recode_files.append(dst)
+
+
+@benchmark('recode_file', setup=_copy_for_recode)
+def bench_recode(ctx):
+    for fname in ctx.recode_files:
+        vimrecoding.recode_file(fname, 'utf-8')
+    return len(ctx.recode_files), ctx.bytes
+
+
+def run(func, setup, ctx, repeat, memory):
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup(ctx)
+        start = time.perf_counter()
+        counts = func(ctx)
+        elapsed = time.perf_counter() - start
+        if counts is None:
+            return None
+        if best is None or elapsed < best:
+            best = elapsed
+    nfiles, nbytes = counts
+    result = {'seconds': best, 'files': nfiles, 'bytes': nbytes,
+              'files_per_s': nfiles / best if best else 0.0,
+              'mb_per_s': nbytes / 1e6 / best if best and nbytes else None}
+    if memory:
+        if setup:
+            setup(ctx)
+        tracemalloc.start()
+        try:
+            func(ctx)
+            result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def print_results(results, baseline=None):
+    print('%-24s %9s %10s %10s %9s %s' % ('benchmark', 'time(s)', 'files/s', 'MB/s', 'peak(MB)',
+                                          'vs baseline' if baseline else ''))
+    for name, r in results.items():
+        mbs = '%10.1f' % r['mb_per_s'] if r['mb_per_s'] else '%10s' % '-'
+        peak = '%9.1f' % r['peak_mb'] if 'peak_mb' in r else '%9s' % '-'
+        cmp = ''
+        old = (baseline or {}).get(name)
+        if old and r['seconds']:
+            cmp = '%.2fx' % (old['seconds'] / r['seconds'])
+        print('%-24s %9.3f %10.0f %s %s %s' % (name, r['seconds'], r['files_per_s'], mbs, peak, cmp))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    gentree.add_arguments(parser)
+    parser.add_argument('--dir', help='use an existing tree (must contain bench.vprj) instead of generating one')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--no-memory', dest='memory', action='store_false')
+    parser.add_argument('--only', action='append', help='run benchmarks whose name contains this text')
+    parser.add_argument('--json', help='save results to this file')
+    parser.add_argument('--compare', help='compare with results saved by --json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='vpbench') as tmp:
+        root = args.dir or tmp
+        if args.dir:
+            tree = {'dir': args.dir}
+        else:
+            tree = gentree.generate_from_args(root, args)
+        ctx = Context(root, args.workers)
+        try:
+            ctx.open_project()
+            print('%d project files, %.1f MB' % (len(ctx.files), ctx.bytes / 1e6))
+            results = {}
+            for name, func, setup in BENCHMARKS:
+                if args.only and not any(s in name for s in args.only):
+                    continue
+                result = run(func, setup, ctx, args.repeat, args.memory)
+                if result:
+                    results[name] = result
+        finally:
+            ctx.close()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fp:
+            baseline = json.load(fp)['results']
+    print_results(results, baseline)
+
+    if args.json:
+        meta = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+            'tree': tree,
+        }
+        with open(args.json, 'w', encoding='utf-8') as fp:
+            json.dump({'meta': meta, 'results': results}, fp, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""比较按PATH×SUFFIX逐个glob与单次遍历目录两种方式收集项目文件的耗时
+
+    python bench/bench_walk.py --files 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent / 'plugin'))
+
+from projfiles import PathFilter, walk_files
+
+CPP_SUFFIX = ['.c', '.h', '.cpp', '.cc', '.cxx', '.hpp', '.hxx', '.hh']
+
+
+def make_tree(root, nfiles, depth, width):
+    random.seed(0)
+    dirs = ['']
+    level = ['']
+    for _ in range(depth):
+        level = [os.path.join(d, 'd%d' % i) for d in level for i in range(width)]
+        dirs += level
+    for d in dirs:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    suffixes = CPP_SUFFIX + ['.txt', '.o', '.md']
+    for i in range(nfiles):
+        d = random.choice(dirs)
+        open(os.path.join(root, d, 'f%d%s' % (i, random.choice(suffixes))), 'w').close()
+
+
+def glob_files(basedir, path, suffix):
+    # 原来的实现
+    basedir = Path(basedir)
+    for ptn in path:
+        for s in suffix:
+            yield from basedir.glob(ptn + "/*" + s)
+
+
+def timeit(func):
+    start = time.perf_counter()
+    n = sum(1 for _ in func())
+    return time.perf_counter() - start, n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--width', type=int, default=6)
+    parser.add_argument('--dir', help='use an existing tree instead of generating one')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.dir or tmp
+        if not args.dir:
+            make_tree(root, args.files, args.depth, args.width)
+        path = ['.', '**']
+        t_glob, n_glob = timeit(lambda: glob_files(root, path, CPP_SUFFIX))
+        t_walk, n_walk = timeit(lambda: walk_files(PathFilter(root, path, CPP_SUFFIX)))
+        print('glob: %8.3fs %8d files' % (t_glob, n_glob))
+        print('walk: %8.3fs %8d files' % (t_walk, n_walk))
+        print('speedup: %.1fx' % (t_glob / t_walk))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""不需要Vim的vim模块替身，用于在Vim之外运行和测量vimproject
+
+    import fakevim
+    fakevim.install()
+    import vimproject
+
+只模拟vimproject用到的部分：选项、当前目录、quickfix列表和定时器。
+执行过的命令记录在commands中，无法识别的表达式抛出error，
+也可以在responses中预先给出表达式的结果。
+"""
+
+import os
+import re
+import sys
+
+features = {'timers', 'python3'}
+options = {'encoding': 'utf-8', 'ft': '', 'efm': '', 'path': '', 'tags': ''}
+responses = {}
+commands = []
+vars = {}
+cwd = os.getcwd()
+current_file = ''
+
+# quickfix列表栈，每项为{'id', 'title', 'items'}
+qflists = []
+qfindex = -1
+_next_id = [1]
+_timers = [0]
+
+
+class error(Exception):
+    pass
+
+
+def reset():
+    global cwd, qfindex
+    del commands[:]
+    del qflists[:]
+    qfindex = -1
+    responses.clear()
+    cwd = os.getcwd()
+
+
+def install():
+    """用本模块代替vim模块，必须在导入vimproject之前调用"""
+    sys.modules['vim'] = sys.modules[__name__]
+
+
+def _unescape(s):
+    return re.sub(r'\\(.)', r'\1', s)
+
+
+def _qflist(qfid=0):
+    if not qfid:
+        return qflists[qfindex] if qflists else None
+    for qf in qflists:
+        if qf['id'] == qfid:
+            return qf
+    return None
+
+
+def _new_qflist(title=''):
+    global qfindex
+    qf = {'id': _next_id[0], 'title': title, 'items': []}
+    _next_id[0] += 1
+    del qflists[qfindex + 1:]
+    qflists.append(qf)
+    qfindex = len(qflists) - 1
+    return qf
+
+
+def _lines_to_items(lines):
+    # 不模拟errorformat，只按"文件:行号:内容"解析
+    items = []
+    for line in lines:
+        m = re.match(r'^(.+?):(\d+):(.*)$', line)
+        if m:
+            items.append({'filename': m.group(1), 'lnum': int(m.group(2)), 'text': m.group(3), 'valid': 1})
+        else:
+            items.append({'text': line, 'valid': 0})
+    return items
+
+
+def setqflist(lst, action=' ', what=None):
+    if what is None:
+        what = {'items': lst}
+    qf = _qflist(what.get('id', 0))
+    if action == ' ' or qf is None:
+        qf = _new_qflist()
+    items = [dict(it) for it in what.get('items', [])] + _lines_to_items(what.get('lines', []))
+    if action == 'r':
+        qf['items'] = items
+    else:
+        qf['items'].extend(items)
+    if 'title' in what:
+        qf['title'] = what['title']
+    return 0
+
+
+def getqflist(what=None):
+    qf = _qflist((what or {}).get('id', 0))
+    if what is None:
+        return qf['items'] if qf else []
+    return {'id': qf['id'] if qf else 0, 'items': qf['items'] if qf else [], 'title': qf['title'] if qf else ''}
+
+
+def execute(cmds, silent=''):
+    if isinstance(cmds, str):
+        cmds = [cmds]
+    for cmd in cmds:
+        command(cmd)
+    return ''
+
+
+def timer_start(*args):
+    _timers[0] += 1
+    return _timers[0]
+
+
+_FUNCTIONS = {
+    'setqflist': setqflist,
+    'getqflist': getqflist,
+    'execute': execute,
+    'timer_start': timer_start,
+}
+
+
+class Function(object):
+    def __init__(self, name):
+        if name not in _FUNCTIONS:
+            raise error('E117: Unknown function: %s' % name)
+        self.name = name
+
+    def __call__(self, *args):
+        return _FUNCTIONS[self.name](*args)
+
+
+def command(cmd):
+    global cwd
+    commands.append(cmd)
+    cmd = re.sub(r'^(silent!?\s+)', '', cmd.strip())
+    m = re.match(r'^set\s+(\w+)(\+?=)(.*)$', cmd)
+    if m:
+        name, op, value = m.groups()
+        value = _unescape(value)
+        if op == '+=' and options.get(name):
+            value = options[name] + ',' + value
+        options[name] = value
+        return
+    m = re.match(r'^l?cd\s+(.*)$', cmd)
+    if m:
+        cwd = _unescape(m.group(1))
+        return
+    m = re.match(r'^cfile\s+(.*)$', cmd)
+    if m:
+        with open(_unescape(m.group(1)), encoding='utf-8', errors='replace') as fp:
+            _new_qflist(':cfile').update(items=_lines_to_items(fp.read().splitlines()))
+
+
+def eval(expr):
+    if expr in responses:
+        return responses[expr]
+    if expr.startswith('&'):
+        return options.get(expr[1:], '')
+    if expr.startswith('$'):
+        return os.environ.get(expr[1:], '')
+    if expr == 'getcwd()':
+        return cwd
+    m = re.match(r'''^has\(["'](\w+)["']\)$''', expr)
+    if m:
+        return '1' if m.group(1) in features else '0'
+    m = re.match(r'''^expand\(["']%(:\w)*["']\)$''', expr)
+    if m:
+        if m.group(1) == ':e':
+            return os.path.splitext(current_file)[1][1:]
+        return current_file
+    m = re.match(r"^getqflist\(\{'id': (\d+)\}\)\.id$", expr)
+    if m:
+        return str(getqflist({'id': int(m.group(1))})['id'])
+    if expr == "!empty(filter(getqflist(), 'v:val.valid'))":
+        return '1' if any(it.get('valid') for it in getqflist()) else '0'
+    m = re.match(r"^setqflist\(\[\], 'r', \{'id': (\d+), 'items': getqflist\(.*\)\.items\[:-2\]\}\)$", expr)
+    if m:
+        qf = _qflist(int(m.group(1)))
+        if qf:
+            del qf['items'][-1:]
+        return '0'
+    m = re.match(r"^timer_start\(", expr)
+    if m:
+        return str(timer_start())
+    raise error('E121: Undefined expression: %s' % expr)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""生成用于测试的项目目录
+
+    python bench/gentree.py DIR --files 20000 --size 8 --encodings utf-8:70,gb18030:20,big5:10
+
+目录中同时生成bench.vprj，PATH为'**'，SUFFIX为生成的全部后缀。
+"""
+
+import argparse
+import os
+import random
+
+IDENTS = ['foo_bar', 'buffer', 'count', 'index', 'result', 'value', 'handle', 'context', 'length', 'status']
+# 各编码使用的非ascii注释，big5只能编码繁体字
+COMMENTS = {
+    'utf-8': ['处理缓冲区中的数据', 'überprüfen Sie den Wert', '返回值表示是否成功'],
+    'gb18030': ['处理缓冲区中的数据', '返回值表示是否成功', '初始化上下文'],
+    'big5': ['處理緩衝區中的資料', '返回值表示是否成功', '初始化上下文'],
+}
+DEFAULT_SUFFIXES = '.c:40,.h:30,.cpp:20,.txt:10'
+DEFAULT_ENCODINGS = 'utf-8:80,gb18030:10,big5:10'
+
+
+def parse_mix(text):
+    """"a:3,b:1"转换为([a, b], [3, 1])"""
+    names = []
+    weights = []
+    for part in text.split(','):
+        name, _, weight = part.partition(':')
+        names.append(name)
+        weights.append(float(weight or 1))
+    return names, weights
+
+
+def make_line(rnd, enc):
+    if rnd.random() < 0.1 and enc in COMMENTS:
+        return '    // %s\n' % rnd.choice(COMMENTS[enc])
+    a, b = rnd.sample(IDENTS, 2)
+    return '    %s = %s(%s, %d);\n' % (a, b, rnd.choice(IDENTS), rnd.randrange(1000))
+
+
+def make_text(rnd, size, enc):
+    lines = ['int func_%d(void)\n{\n' % rnd.randrange(1 << 20)]
+    total = len(lines[0])
+    while total < size:
+        line = make_line(rnd, enc)
+        lines.append(line)
+        total += len(line)
+    lines.append('}\n')
+    return ''.join(lines)
+
+
+def file_size(rnd, mean, dist):
+    if dist == 'fixed':
+        return mean
+    # 对数正态分布，大部分文件较小，少数文件很大
+    return max(64, int(rnd.lognormvariate(0, 1) * mean / 1.65))
+
+
+def make_dirs(root, depth, width):
+    dirs = ['']
+    level = ['']
+    for _ in range(depth):
+        level = [os.path.join(d, 'd%d' % i) for d in level for i in range(width)]
+        dirs += level
+    for d in dirs:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    return dirs
+
+
+def generate(root, files=10000, size=8192, dist='lognormal', depth=3, width=5, suffixes=DEFAULT_SUFFIXES,
+             encodings=DEFAULT_ENCODINGS, seed=0):
+    """生成项目目录，返回{'files': 文件数, 'bytes': 总字节数, 'encodings': {编码: 文件数}}"""
+    rnd = random.Random(seed)
+    dirs = make_dirs(root, depth, width)
+    suffix_names, suffix_weights = parse_mix(suffixes)
+    enc_names, enc_weights = parse_mix(encodings)
+    total = 0
+    counts = {}
+    for i in range(files):
+        suffix = rnd.choices(suffix_names, suffix_weights)[0]
+        enc = rnd.choices(enc_names, enc_weights)[0]
+        data = make_text(rnd, file_size(rnd, size, dist), enc).encode(enc)
+        with open(os.path.join(root, rnd.choice(dirs), 'f%d%s' % (i, suffix)), 'wb') as fp:
+            fp.write(data)
+        total += len(data)
+        counts[enc] = counts.get(enc, 0) + 1
+    with open(os.path.join(root, 'bench.vprj'), 'w') as fp:
+        fp.write('PATH = ["**"]\n')
+        fp.write('SUFFIX = %r\n' % [s for s in suffix_names if s != '.txt'])
+    return {'files': files, 'bytes': total, 'encodings': counts}
+
+
+def add_arguments(parser):
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--size', type=float, default=8, help='mean file size in KB')
+    parser.add_argument('--dist', choices=['lognormal', 'fixed'], default='lognormal')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--width', type=int, default=5)
+    parser.add_argument('--suffixes', default=DEFAULT_SUFFIXES)
+    parser.add_argument('--encodings', default=DEFAULT_ENCODINGS)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def generate_from_args(root, args):
+    return generate(root, args.files, int(args.size * 1024), args.dist, args.depth, args.width, args.suffixes,
+                    args.encodings, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dir')
+    add_arguments(parser)
+    args = parser.parse_args()
+    info = generate_from_args(args.dir, args)
+    print('%d files, %.1f MB, %s' % (info['files'], info['bytes'] / 1e6, info['encodings']))
+
+
+if __name__ == '__main__':
+    main()
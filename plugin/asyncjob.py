@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import signal
+import subprocess
+import threading
+import time
+import traceback
+
+IS_WIN = os.name == 'nt'
+
+
+class _Job(object):
+    """后台线程产生的结果先缓存起来，调用者在Vim的定时器中用take()取走"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.cancelled = False
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.thread = None
+
+    def take(self, limit=None):
+        """取走已经产生的结果，最多limit项"""
+        with self.lock:
+            if limit is None or len(self.pending) <= limit:
+                lines, self.pending = self.pending, []
+            else:
+                lines, self.pending = self.pending[:limit], self.pending[limit:]
+        return lines
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def finished(self):
+        """后台线程已经结束并且所有结果都已取走"""
+        with self.lock:
+            return not self.thread.is_alive() and not self.pending
+
+
+class AsyncJob(_Job):
+    """在后台运行命令，输出同时写入logfile，并按行缓存等待取走"""
+
+    def __init__(self, cmd, cwd, logfile):
+        _Job.__init__(self)
+        self.cmd = cmd
+        kwargs = {}
+        if IS_WIN:
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['start_new_session'] = True
+        self.proc = subprocess.Popen(cmd, shell=True, cwd=cwd, stdin=subprocess.DEVNULL,
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+        self.log = open(logfile, 'wb')
+        self.thread = threading.Thread(target=self._read_output, name='vimproject-job', daemon=True)
+        self.thread.start()
+
+    def _read_output(self):
+        try:
+            for line in self.proc.stdout:
+                self.log.write(line)
+                with self.lock:
+                    self.pending.append(line)
+        finally:
+            self.proc.wait()
+            self.elapsed = time.perf_counter() - self.start
+            self.log.close()
+
+    def returncode(self):
+        return self.proc.returncode
+
+    def cancel(self):
+        if self.proc.poll() is not None:
+            return
+        self.cancelled = True
+        try:
+            if IS_WIN:
+                subprocess.call(['taskkill', '/F', '/T', '/PID', str(self.proc.pid)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            else:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+
+class ThreadJob(_Job):
+    """在后台线程中遍历iterable，每一项缓存等待取走
+
+    用于不需要子进程的耗时操作。cancel()后在下一项时停止，iterable为生成器时会被关闭。
+    iterable长时间不产生结果时，可以把stop（threading.Event）也交给它，cancel()时设置。
+    """
+
+    def __init__(self, iterable, stop=None, name='vimproject-thread'):
+        _Job.__init__(self)
+        self.stop = stop
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(iterable, ), name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self, iterable):
+        it = iter(iterable)
+        try:
+            for item in it:
+                if self.cancelled:
+                    break
+                with self.lock:
+                    self.pending.append(item)
+        except Exception:
+            self.error = traceback.format_exc()
+        finally:
+            close = getattr(it, 'close', None)
+            if close:
+                close()
+            self.elapsed = time.perf_counter() - self.start
+
+    def cancel(self):
+        self.cancelled = True
+        if self.stop:
+            self.stop.set()
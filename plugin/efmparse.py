@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# 在Python中按Vim的errorformat解析编译输出，只支持_COMPILER_EFM用到的部分
+
+import os
+import re
+
+# 各转换符对应的正则，与Vim的errorformat一致
+_FIELDS = {
+    'f': r'.+',
+    'o': r'.+',
+    'n': r'\d+',
+    'l': r'\d+',
+    'c': r'\d+',
+    'v': r'\d+',
+    't': r'.',
+    'm': r'.+',
+    'r': r'.*',
+    'p': r'[- \t.]*',
+    's': r'.+',
+}
+
+# 支持的前缀，多行格式以E、W、A开始，C、Z继续，G为普通信息
+_PREFIXES = 'EWACZG'
+
+
+def _char_class(fmt, i):
+    """fmt[i]为'['，返回(正则的字符类, ']'之后的位置)"""
+    j = i + 1
+    if fmt[j:j + 1] == '^':
+        j += 1
+    if fmt[j:j + 1] == ']':
+        j += 1
+    j = fmt.index(']', j)
+    return fmt[i:j + 1].replace('\\', '\\\\'), j + 1
+
+
+def compile_format(fmt):
+    """把一个errorformat编译为(前缀, 标志, 正则)，标志为''、'-'或'+'
+
+    不支持的格式抛出ValueError。
+    """
+    i = 0
+    flag = ''
+    prefix = ''
+    if fmt[:2] in ('%-', '%+'):
+        # "%-Z"、"%+C"等
+        flag = fmt[1]
+        prefix = fmt[2:3]
+        i = 3
+    elif fmt[1:2].isupper() and fmt[0] == '%':
+        prefix = fmt[1]
+        i = 2
+    if prefix and prefix not in _PREFIXES:
+        raise ValueError('unsupported errorformat: %s' % fmt)
+
+    out = []
+    groups = []
+    last = None
+    fields = set()
+    try:
+        while i < len(fmt):
+            c = fmt[i]
+            i += 1
+            if c == '\\':
+                # 格式中用"\,"表示逗号
+                out.append(re.escape(fmt[i]))
+                i += 1
+                continue
+            if c != '%':
+                out.append(re.escape(c))
+                continue
+            c = fmt[i]
+            i += 1
+            if c in _FIELDS:
+                if c in fields:
+                    raise ValueError('duplicate %%%s in errorformat: %s' % (c, fmt))
+                fields.add(c)
+                ptn = _FIELDS[c]
+                if c == 'f' and i < len(fmt):
+                    # 与Vim相同：文件名后是普通字符时尽量少匹配，否则只匹配文件名字符
+                    ptn = r'(?:[A-Za-z]:)?[^\s:()"\',]+' if fmt[i] in '\\%' else r'.+?'
+                out.append('(?P<%s>%s)' % (c, ptn))
+            elif c == '*' and fmt[i:i + 1] == '[':
+                ptn, i = _char_class(fmt, i)
+                out.append(ptn + '*')
+            elif c == '[':
+                ptn, i = _char_class(fmt, i - 1)
+                out.append(ptn)
+            elif c == '.':
+                out.append('.')
+            elif c == '#':
+                out.append('*')
+            elif c == '%':
+                out.append('%')
+            elif c == '\\':
+                c = fmt[i]
+                i += 1
+                if c == '(':
+                    groups.append(len(out))
+                    out.append('(?:')
+                elif c == ')':
+                    last = groups.pop()
+                    out.append(')')
+                elif c == '@' and fmt[i:i + 1] == '=' and last is not None:
+                    # "%\(...%\)%\@="为向前查看
+                    out[last] = '(?='
+                    i += 1
+                elif c == '+':
+                    out.append('+')
+                elif c == '=':
+                    out.append('?')
+                elif c in 'sSdDwW':
+                    out.append('\\' + c)
+                else:
+                    raise ValueError('unsupported errorformat: %s' % fmt)
+            else:
+                raise ValueError('unsupported errorformat: %s' % fmt)
+        regex = re.compile(''.join(out))
+    except (IndexError, re.error):
+        raise ValueError('bad errorformat: %s' % fmt)
+    return prefix, flag, regex
+
+
+class ErrorParser(object):
+    """按errorformat逐行解析编译输出
+
+    formats为[(格式, 是否为警告), ...]，按顺序匹配，相对路径的文件名基于basedir。
+    解析结果为[(类别, 原始行, quickfix条目), ...]，类别为'e'、'w'或None（没有匹配的行）。
+    原始行只为警告保存，关闭警告时用不含警告格式的解析器重新解析这些行。
+    """
+
+    def __init__(self, formats, basedir=None):
+        self.entries = [compile_format(fmt) + (warning, ) for fmt, warning in formats]
+        self.basedir = basedir
+        self.reset()
+
+    def copy(self):
+        """共用编译好的格式，解析状态各自独立"""
+        ret = ErrorParser.__new__(ErrorParser)
+        ret.entries = self.entries
+        ret.basedir = self.basedir
+        ret.reset()
+        return ret
+
+    def reset(self):
+        self.done = []
+        self.pending = []
+        self.current = None  # 正在解析的多行记录
+
+    def _add(self, record):
+        if self.current:
+            self.pending.append(record)
+        else:
+            self.done.append(record)
+
+    def _end(self):
+        self.done.extend(self.pending)
+        self.pending = []
+        self.current = None
+
+    def _merge(self, item, fields):
+        fname = fields.get('f')
+        if fname and not item.get('filename'):
+            item['filename'] = os.path.join(self.basedir, fname) if self.basedir else fname
+        for key, name in (('l', 'lnum'), ('c', 'col'), ('v', 'col'), ('n', 'nr')):
+            if fields.get(key) and not item.get(name):
+                item[name] = int(fields[key])
+                if key == 'v':
+                    item['vcol'] = 1
+        if fields.get('p') is not None and not item.get('col'):
+            item['col'] = len(fields['p']) + 1
+            item['vcol'] = 1
+        if fields.get('t') and not item.get('type'):
+            item['type'] = fields['t']
+        if fields.get('s') and not item.get('pattern'):
+            item['pattern'] = '^\\V' + fields['s'].replace('\\', '\\\\') + '\\$'
+
+    def _parse_line(self, line):
+        for prefix, flag, regex, warning in self.entries:
+            if prefix in ('C', 'Z') and not self.current:
+                continue
+            mobj = regex.fullmatch(line)
+            if mobj:
+                break
+        else:
+            self._add((None, None, {'text': line, 'valid': 0}))
+            return
+
+        fields = mobj.groupdict()
+        msg = line if flag == '+' else fields.get('m')
+        if prefix in ('C', 'Z'):
+            kind, lines, item = self.current
+            if lines is not None:
+                lines.append(line)
+            self._merge(item, fields)
+            if msg and flag != '-':
+                item['text'] = item['text'] + '\n' + msg if item['text'] else msg
+            if prefix == 'Z':
+                self._end()
+            return
+
+        self._end()
+        if flag == '-':
+            return
+        if prefix == 'G':
+            self._add((None, None, {'text': msg or line, 'valid': 0}))
+            return
+        item = {'text': msg or '', 'valid': 1}
+        if prefix in ('E', 'W'):
+            item['type'] = prefix
+        self._merge(item, fields)
+        record = ('w' if warning else 'e', [line] if warning else None, item)
+        if prefix in ('E', 'W', 'A'):
+            # 多行记录在结束之前不返回，后面的行还会修改它
+            self.current = record
+            self.pending.append(record)
+        else:
+            self._add(record)
+
+    def feed(self, lines):
+        """解析lines，返回已经完成的记录，未结束的多行记录留到以后返回"""
+        for line in lines:
+            self._parse_line(line)
+        done, self.done = self.done, []
+        return done
+
+    def flush(self):
+        self._end()
+        done, self.done = self.done, []
+        return done
+
+    def parse(self, lines):
+        self.reset()
+        return self.feed(lines) + self.flush()
+
+
+def quickfix_items(records, warning=True, parser=None):
+    """记录对应的quickfix条目
+
+    warning为False时，警告的原始行用parser（不含警告格式的解析器）重新解析。
+    """
+    for kind, lines, item in records:
+        if kind == 'w' and not warning:
+            for record in parser.parse(lines):
+                yield record[2]
+        else:
+            yield item
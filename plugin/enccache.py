@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+import threading
+
+from fileutil import atomic_write, file_stamp
+
+
+class EncodingCache(object):
+    """记录每个文件检测到的编码，文件修改时间或大小变化后记录失效
+
+    记录的格式为{路径: [修改时间, 大小, 编码]}，保存在项目的临时目录中。
+    store为statedb.ProjectState时保存在其中，只写入变化了的记录，否则保存为json文件fname。
+    后台搜索的线程和主线程会同时使用，各方法都在lock中进行。
+    """
+
+    def __init__(self, fname, store=None):
+        self.fname = fname
+        self.store = store
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changed = set()
+        self.load()
+
+    @property
+    def dirty(self):
+        return bool(self.changed)
+
+    def load(self):
+        self.changed = set()
+        if self.store:
+            self.entries = self.store.encodings()
+            if self.entries:
+                return
+        try:
+            with open(self.fname, encoding='utf-8') as fp:
+                self.entries = json.load(fp)
+        except (IOError, ValueError):
+            self.entries = {}
+        if self.store:
+            # 以前保存在json文件中的记录转存到数据库
+            self.changed = set(self.entries)
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            if self.store:
+                self.store.save_encodings({k: self.entries[k] for k in self.changed if k in self.entries})
+            else:
+                with atomic_write(self.fname, encoding='utf-8') as fp:
+                    json.dump(self.entries, fp)
+            self.changed = set()
+
+    def lookup(self, path, stamp):
+        with self.lock:
+            entry = self.entries.get(str(path))
+        if entry and stamp and entry[0] == stamp[0] and entry[1] == stamp[1]:
+            return entry[2]
+        return None
+
+    def get(self, path):
+        return self.lookup(path, file_stamp(path))
+
+    def set(self, path, enc, stamp=None):
+        stamp = stamp or file_stamp(path)
+        if stamp:
+            with self.lock:
+                self.entries[str(path)] = [stamp[0], stamp[1], enc]
+                self.changed.add(str(path))
+
+    def subset(self, paths):
+        """paths对应的记录，用于传给工作进程"""
+        with self.lock:
+            return {str(p): self.entries[str(p)] for p in paths if str(p) in self.entries}
+
+    def update(self, entries):
+        if entries:
+            with self.lock:
+                self.entries.update(entries)
+                self.changed.update(entries)
+
+    def encodings(self):
+        """记录中出现过的所有编码"""
+        with self.lock:
+            return set(e[2] for e in self.entries.values())
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+
+def file_stamp(path):
+    """文件的(修改时间, 大小)，文件不存在时返回None。path也可以是打开的文件描述符"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def temp_fname(fname):
+    """在fname所在的目录中建立一个名字唯一的空文件并返回其名字，由调用者删除
+
+    用于让ctags、cscope等外部程序写入后再改名，共用临时目录的多个Vim不会写到同一个文件。
+    """
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.' + basename + '.')
+    os.close(fd)
+    return tmpname
+
+
+@contextmanager
+def atomic_write(fname, mode='w', keep_mode=False, **kwargs):
+    """先写入同一目录中的临时文件，完成后再改名为fname，中途出错时不改变fname
+
+    临时文件名每次不同，多个线程或者共用临时目录的多个Vim同时写入时不会互相破坏。
+    keep_mode为True时沿用原文件的权限。
+    """
+    tmpname = temp_fname(fname)
+    try:
+        with open(tmpname, mode, **kwargs) as fp:
+            yield fp
+        if keep_mode:
+            shutil.copymode(fname, tmpname)
+    except BaseException:
+        os.remove(tmpname)
+        raise
+    os.replace(tmpname, fname)
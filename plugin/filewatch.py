@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import select
+import struct
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _libc.inotify_init1
+except (ImportError, OSError, AttributeError):
+    _libc = None
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+_WATCH_MASK = (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct('iIII')
+
+
+class FileWatcher(threading.Thread):
+    """在后台监视项目目录，文件增删时调用on_change(added, removed, removed_dirs, reset)
+
+    added为新增文件路径的列表，removed为被删除的项目文件路径的列表，removed_dirs为被删除的
+    目录的列表，其下的所有文件都应当从项目中去掉。reset为True时added是完整的文件列表。
+    on_change在后台线程中调用，不能使用vim模块。Linux下使用inotify，其他系统定时轮询。
+    stop()立即唤醒线程，线程在处理完当前的事件后结束。
+    """
+
+    def __init__(self, filt, on_change, interval=2.0):
+        super(FileWatcher, self).__init__(name='vimproject-watcher', daemon=True)
+        self.filt = filt
+        self.on_change = on_change
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.dirs = {}
+        self.error = None
+
+    def stop(self, wait=True):
+        """结束监视，wait为False时不等待线程结束，如退出Vim时"""
+        self.stop_event.set()
+        self.wake()
+        if wait and self.is_alive():
+            self.join()
+
+    def wake(self):
+        pass
+
+    def _need_watch(self, path):
+        return self.filt.match_dir(path) or self.filt.may_contain(path)
+
+    def _scan_dir(self, path, added):
+        """登记path及其下需要监视的目录，把已有的项目文件加入added"""
+        if self.stop_event.is_set():
+            return
+        # 先开始监视再读取目录，期间新建的文件不会遗漏，重复加入的文件由调用者去重
+        self.watch(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            entries = list(os.scandir(path))
+        except OSError:
+            self.unwatch(path)
+            return
+        self.dirs[path] = self._dir_stamp(mtime, entries)
+        match_dir = self.filt.match_dir(path)
+        check = match_dir and self.filt.has_file_rules(path)
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir:
+                if entry.path not in self.dirs and self.filt.enter(entry):
+                    self._scan_dir(entry.path, added)
+            elif match_dir and self.filt.match_suffix(entry.name) and not (check and self.filt.ignored(entry.path)):
+                added.append(entry.path)
+
+    def _forget_dir(self, path):
+        prefix = os.path.join(path, '')
+        for d in [d for d in self.dirs if d == path or d.startswith(prefix)]:
+            self.unwatch(d)
+            del self.dirs[d]
+
+    def _dir_stamp(self, mtime, entries):
+        return None
+
+    def watch(self, path):
+        pass
+
+    def unwatch(self, path):
+        pass
+
+    def initial_scan(self):
+        added = []
+        for root in self.filt.roots():
+            if os.path.isdir(root):
+                self._scan_dir(root, added)
+        return added
+
+    def report(self, added, removed=(), removed_dirs=(), reset=False):
+        if self.stop_event.is_set():
+            # 停止时的扫描结果可能不完整
+            return
+        if added or removed or removed_dirs or reset:
+            try:
+                self.on_change(added, removed, removed_dirs, reset)
+            except Exception:
+                import traceback
+                self.error = traceback.format_exc()
+
+
+class PollingWatcher(FileWatcher):
+    """定时比较目录的修改时间，只重新读取发生变化的目录"""
+
+    def _dir_stamp(self, mtime, entries):
+        # 修改时间在读取目录之前取得，读取期间的变化下次还能发现
+        return mtime, set(e.name for e in entries)
+
+    def poll(self):
+        added = []
+        removed = []
+        removed_dirs = []
+        for path, (mtime, names) in list(self.dirs.items()):
+            if path not in self.dirs:
+                continue
+            try:
+                new_mtime = os.stat(path).st_mtime_ns
+                if new_mtime == mtime:
+                    continue
+                entries = list(os.scandir(path))
+            except OSError:
+                self._forget_dir(path)
+                removed_dirs.append(path)
+                continue
+            self.dirs[path] = self._dir_stamp(new_mtime, entries)
+            new_names = set(e.name for e in entries)
+            for name in names - new_names:
+                sub = os.path.join(path, name)
+                # 没有监视的目录下不会有项目文件
+                if sub in self.dirs:
+                    self._forget_dir(sub)
+                    removed_dirs.append(sub)
+                elif self.filt.match_suffix(name):
+                    removed.append(sub)
+            for entry in entries:
+                if entry.name in names:
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    if self.filt.enter(entry):
+                        self._scan_dir(entry.path, added)
+                elif self.filt.match_file(entry.path):
+                    added.append(entry.path)
+        self.report(added, removed, removed_dirs)
+
+    def run(self):
+        self.report(self.initial_scan(), reset=True)
+        while not self.stop_event.wait(self.interval):
+            self.poll()
+
+
+class InotifyWatcher(FileWatcher):
+    def __init__(self, filt, on_change, interval=2.0):
+        super(InotifyWatcher, self).__init__(filt, on_change, interval)
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # stop()时写入，唤醒等待中的select
+        self.wake_r, self.wake_w = os.pipe()
+        self.wds = {}
+
+    def wake(self):
+        # 写入端由stop()关闭，线程只关闭读取端
+        fd, self.wake_w = self.wake_w, None
+        if fd is None:
+            return
+        try:
+            os.write(fd, b'x')
+        except OSError:
+            pass
+        os.close(fd)
+
+    def watch(self, path):
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            # 通常是超过了fs.inotify.max_user_watches，该目录的变化不再跟踪
+            self.error = 'inotify_add_watch failed: %s: %s' % (path, os.strerror(ctypes.get_errno()))
+            return
+        self.wds[wd] = path
+
+    def unwatch(self, path):
+        for wd, p in list(self.wds.items()):
+            if p == path:
+                _libc.inotify_rm_watch(self.fd, wd)
+                del self.wds[wd]
+
+    def handle(self, data):
+        added = []
+        removed = []
+        removed_dirs = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # 事件丢失，只能重新扫描
+                return True
+            path = self.wds.get(wd)
+            if path is None or mask & IN_IGNORED:
+                self.wds.pop(wd, None)
+                continue
+            if not name:
+                continue
+            sub = os.path.join(path, name)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if mask & IN_ISDIR:
+                    if self._need_watch(sub):
+                        self._scan_dir(sub, added)
+                elif self.filt.match_file(sub):
+                    added.append(sub)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                if mask & IN_ISDIR:
+                    # 没有监视的目录下不会有项目文件
+                    if sub in self.dirs:
+                        self._forget_dir(sub)
+                        removed_dirs.append(sub)
+                elif self.filt.match_suffix(name):
+                    removed.append(sub)
+        self.report(added, removed, removed_dirs)
+        return False
+
+    def run(self):
+        try:
+            self.report(self.initial_scan(), reset=True)
+            while not self.stop_event.is_set():
+                ready, _, _ = select.select([self.fd, self.wake_r], [], [])
+                if self.fd not in ready:
+                    continue
+                try:
+                    data = os.read(self.fd, 65536)
+                except BlockingIOError:
+                    continue
+                if self.handle(data):
+                    self.unwatch_all()
+                    self.dirs = {}
+                    self.report(self.initial_scan(), reset=True)
+        finally:
+            os.close(self.fd)
+            os.close(self.wake_r)
+
+    def unwatch_all(self):
+        for wd in list(self.wds):
+            _libc.inotify_rm_watch(self.fd, wd)
+        self.wds = {}
+
+
+def start_watcher(filt, on_change, interval=2.0):
+    watcher = None
+    if _libc is not None:
+        try:
+            watcher = InotifyWatcher(filt, on_change, interval)
+        except OSError:
+            watcher = None
+    if watcher is None:
+        watcher = PollingWatcher(filt, on_change, interval)
+    watcher.start()
+    return watcher
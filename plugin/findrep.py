@@ -1,52 +1,505 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
+import os
 import sys
 import re
+import mmap
+import shutil
+import subprocess
+import tempfile
+import weakref
+import multiprocessing
+from bisect import bisect_right
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain, islice
 from pathlib import Path
 
+from fileutil import file_stamp
+from vimrecoding import guess_encoding
 
-def find_pattern(files: list, pattern: str, enc):
-    ptn = re.compile(pattern.encode(enc))
+# 每个任务包含的最大文件数，太大时结果返回不及时，太小时进程间通信开销大
+_CHUNK_SIZE = 256
+
+_NEWLINE = re.compile(b'\n')
+
+# 开头这么多字节中有NUL字节的文件作为二进制文件跳过，与git的判断方法相同
+_BINARY_CHECK = 8000
+
+# 出过错的工作进程池，不再使用
+_broken = weakref.WeakSet()
+
+
+@lru_cache(maxsize=32)
+def _compile(pattern: str, enc, flags=re.MULTILINE):
+    # 整个文件一次匹配时，^和$仍按行匹配
+    return re.compile(pattern.encode(enc), flags)
+
+
+# 正则中可以当作普通字符的转义
+_ESCAPE_CHARS = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a'}
+# 匹配一类字符、长度为0的转义
+_CLASS_ESCAPES = set('dDsSwW')
+_ZERO_WIDTH_ESCAPES = set('bBAZ')
+_QUANTIFIER = re.compile(r'\{\d*(,\d*)?\}')
+
+
+def _split_alternatives(pattern: str):
+    # 只按最外层的|分割，遇到分组或字符集时返回None
+    alts = ['']
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            alts[-1] += pattern[i:i + 2]
+            i += 2
+            continue
+        if c in '([':
+            return None
+        if c == '|':
+            alts.append('')
+        else:
+            alts[-1] += c
+        i += 1
+    return alts
+
+
+def _literal_runs(alt: str):
+    """返回匹配中一定出现的字符串片段，以及整个分支是否就是一个字符串"""
+    runs = ['']
+    exact = True
+    i = 0
+    while i < len(alt):
+        c = alt[i]
+        lit = None
+        if c == '\\':
+            e = alt[i + 1:i + 2]
+            i += 2
+            if e in _ESCAPE_CHARS:
+                lit = _ESCAPE_CHARS[e]
+            elif e and not e.isalnum():
+                lit = e
+            elif e in _ZERO_WIDTH_ESCAPES:
+                # 零宽断言不影响字符串本身，但\A和\Z不能只在一行中匹配
+                if e in 'AZ':
+                    exact = False
+                runs.append('')
+                continue
+            elif e not in _CLASS_ESCAPES:
+                # \x41、\101、\N{...}、反向引用等，后面的字符不是字面内容，不再分析
+                return [], False
+        else:
+            i += 1
+            quantifier = _QUANTIFIER.match(alt, i - 1) if c == '{' else None
+            if c not in '.^$*+?{' or (c == '{' and not quantifier):
+                lit = c
+            elif c == '.':
+                pass
+            elif c in '^$':
+                runs.append('')
+                continue
+            else:
+                # 量词作用于前一个字符，该字符不一定出现
+                runs[-1] = runs[-1][:-1]
+                if quantifier:
+                    i = quantifier.end()
+        if lit is None:
+            exact = False
+            runs.append('')
+        else:
+            runs[-1] += lit
+    return [r for r in runs if r], exact and len([r for r in runs if r]) == 1
+
+
+@lru_cache(maxsize=32)
+def literals(pattern: str, enc):
+    """分析正则，返回(必定出现的字符串列表, 正则是否就是这些字符串)
+
+    列表中任意一个字符串都不出现的文件一定不能匹配。无法分析时返回(None, False)。
+    """
+    alts = _split_alternatives(pattern)
+    if not alts:
+        return None, False
+    needles = []
+    exact = True
+    for alt in alts:
+        runs, alt_exact = _literal_runs(alt)
+        if not runs:
+            return None, False
+        exact = exact and alt_exact
+        needles.append(max(runs, key=len).encode(enc))
+    if any(b'\n' in needle for needle in needles):
+        # 跨行的字符串可能从前一个区域中开始，不能只在包含它的行上匹配
+        exact = False
+    return needles, exact
+
+
+@lru_cache(maxsize=None)
+def _same_python(exe):
+    # 工作进程必须与Vim中的Python版本相同，否则无法导入模块或读取传给它的数据
+    try:
+        out = subprocess.run([exe, '-c', 'import sys; print("%d.%d" % sys.version_info[:2])'],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10).stdout
+    except (OSError, subprocess.SubprocessError):
+        return False
+    return out.decode('ascii', 'replace').strip() == '%d.%d' % sys.version_info[:2]
+
+
+def _python_executable():
+    # 在Vim中sys.executable通常是vim本身，不能用来启动工作进程
+    exe = sys.executable
+    if exe and Path(exe).name.lower().startswith('python'):
+        return exe
+    for name in ('python3', 'python'):
+        exe = shutil.which(name)
+        if exe and _same_python(exe):
+            return exe
+    return None
+
+
+def make_executor(workers: int):
+    if workers <= 1:
+        return None
+    exe = _python_executable()
+    if exe:
+        ctx = multiprocessing.get_context('spawn')
+        ctx.set_executable(exe)
+        try:
+            return ProcessPoolExecutor(workers, mp_context=ctx)
+        except OSError:
+            # 无法启动multiprocessing的辅助进程
+            pass
+    return ThreadPoolExecutor(workers)
+
+
+def is_broken(executor):
+    """executor是否出过错，出过错的工作进程池应当关闭"""
+    return executor in _broken
+
+
+def _map_chunks(func, executor, tasks):
+    """按tasks的顺序返回func(*task)的结果
+
+    executor.map按提交顺序返回结果。工作进程池出错时（如工作进程无法启动）记录下来，
+    剩下的任务在当前进程中完成。
+    """
+    done = 0
+    if executor is not None and executor not in _broken:
+        results = executor.map(func, *zip(*tasks))
+        try:
+            for result in results:
+                yield result
+                done += 1
+            return
+        except (BrokenExecutor, BrokenPipeError):
+            _broken.add(executor)
+        finally:
+            # 提前结束时取消还没有开始的任务
+            results.close()
+    for task in tasks[done:]:
+        yield func(*task)
+
+
+def _split_chunks(files: list):
+    size = max(1, min(_CHUNK_SIZE, len(files) // ((os.cpu_count() or 1) * 4)))
+    return [files[i:i + size] for i in range(0, len(files), size)]
+
+
+class _LineIndex(object):
+    """换行符偏移索引，第一次需要行号时才建立"""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.starts = None
+
+    def locate(self, pos):
+        if self.starts is None:
+            self.starts = [0]
+            self.starts.extend(m.end() for m in _NEWLINE.finditer(self.buf))
+        i = bisect_right(self.starts, pos) - 1
+        return i + 1, self.starts[i]
+
+    def line(self, start):
+        end = self.buf.find(b'\n', start)
+        if end < 0:
+            end = len(self.buf)
+        return self.buf[start:end]
+
+
+def _map_file(fp):
+    try:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # 空文件不能映射
+        return b''
+    except OSError:
+        # 管道等特殊文件
+        return fp.read()
+
+
+# 正则就是字符串时，包含它的行不超过这么多个才只在这些行上匹配，否则匹配整个文件
+_MAX_REGIONS = 8
+
+
+def _candidate_regions(buf, needles):
+    # 返回包含任意一个字符串的行范围，按位置顺序排列且互不重叠
+    nexts = [-1] * len(needles)
+    pos = 0
+    while True:
+        for i, needle in enumerate(needles):
+            if nexts[i] is not None and nexts[i] < pos:
+                p = buf.find(needle, pos)
+                nexts[i] = p if p >= 0 else None
+        found = [(p, i) for i, p in enumerate(nexts) if p is not None]
+        if not found:
+            return
+        p, i = min(found)
+        start = buf.rfind(b'\n', 0, p) + 1
+        end = buf.find(b'\n', p + len(needles[i]))
+        if end < 0:
+            yield start, len(buf)
+            return
+        yield start, end
+        pos = end + 1
+
+
+def _region_matches(buf, ptn, needles):
+    # 正则本身就是字符串，出现的地方少时只在包含它的行上运行正则；
+    # 出现的地方多时逐行处理反而比匹配整个文件慢
+    regions = list(islice(_candidate_regions(buf, needles), _MAX_REGIONS))
+    if len(regions) == _MAX_REGIONS:
+        return ptn.finditer(buf)
+    return chain.from_iterable(ptn.finditer(buf, start, end) for start, end in regions)
+
+
+def _search_buffer(buf, fname, ptn, enc, msgs, needles=None, exact=False):
+    if needles is not None:
+        if exact:
+            matches = _region_matches(buf, ptn, needles)
+        elif any(buf.find(needle) >= 0 for needle in needles):
+            matches = ptn.finditer(buf)
+        else:
+            return
+    else:
+        matches = ptn.finditer(buf)
+
+    index = _LineIndex(buf)
+    for mobj in matches:
+        lineno, start = index.locate(mobj.start())
+        msgs.append((fname, lineno,
+                     mobj.start() - start + 1,
+                     index.line(start).rstrip().decode(enc)))
+
+
+def _known_encoding(known, fname, stamp):
+    entry = known.get(fname) if known else None
+    if entry and entry[0] == stamp[0] and entry[1] == stamp[1]:
+        return entry[2]
+    return None
+
+
+def _is_binary(buf):
+    return buf.find(b'\0', 0, _BINARY_CHECK) >= 0
+
+
+def _detect_encoding(data, enc):
+    # 纯ascii的文件按项目编码处理，非ascii的正则也能编码
+    file_enc = guess_encoding(bytes(data))[0]
+    if not file_enc or file_enc == 'ascii':
+        return enc
+    return file_enc
+
+
+def _search_file(fname, buf, pattern, enc, msgs):
+    needles, exact = literals(pattern, enc)
+    _search_buffer(buf, fname, _compile(pattern, enc), enc, msgs, needles, exact)
+
+
+def _find_in_files(files: list, pattern: str, enc, known=None, maxsize=0):
+    """在files中查找，返回(匹配, 出错的文件, 新检测到的文件编码, 读取的字节数)
+
+    跳过二进制文件和大于maxsize字节的文件，maxsize为0时不限制大小。
+    """
+    msgs = []
+    errors = []
+    detected = {}
+    nbytes = 0
     for fname in files:
         try:
             with open(fname, 'rb') as fp:
-                for i, line in enumerate(fp):
-                    for mobj in ptn.finditer(line):
-                        yield "{0}:{1}:{2}:{3}".format(
-                            str(fname), i + 1,
-                            mobj.start() + 1,
-                            line.rstrip().decode(enc))
+                stamp = file_stamp(fp.fileno())
+                if maxsize and stamp[1] > maxsize:
+                    continue
+                buf = _map_file(fp)
+                try:
+                    if _is_binary(buf):
+                        continue
+                    nbytes += stamp[1]
+                    file_enc = _known_encoding(known, fname, stamp)
+                    if file_enc is None and not pattern.isascii():
+                        # 非ascii的正则必须先知道文件编码才能匹配
+                        file_enc = _detect_encoding(buf, enc)
+                        detected[fname] = list(stamp) + [file_enc]
+                    count = len(msgs)
+                    try:
+                        _search_file(fname, buf, pattern, file_enc or enc, msgs)
+                    except UnicodeDecodeError:
+                        if file_enc is not None:
+                            raise
+                        # 文件编码与项目编码不同，检测后重新查找
+                        del msgs[count:]
+                        file_enc = _detect_encoding(buf, enc)
+                        detected[fname] = list(stamp) + [file_enc]
+                        _search_file(fname, buf, pattern, file_enc, msgs)
+                finally:
+                    if isinstance(buf, mmap.mmap):
+                        buf.close()
         except (IOError, FileExistsError, UnicodeError):
-            # import traceback
-            # print(traceback.format_exc(), file=sys.stderr)
-            print("file: %s" % fname, file=sys.stderr)
-            pass
+            errors.append(fname)
+    return msgs, errors, detected, nbytes
+
+
+def find_matches(files: list, pattern: str, enc, executor=None, encodings=None, stats=None, cancel=None,
+                 errors=None, maxsize=0):
+    """返回(文件名, 行号, 列号, 行内容)，跳过二进制文件和大于maxsize字节的文件
+
+    encodings为EncodingCache时使用并更新其中记录的文件编码。
+    stats不为None时在其中累加读取的文件数和字节数。
+    cancel为threading.Event，设置后在处理完当前的一组文件时停止。
+    errors为列表时把无法读取的文件加入其中，否则输出到stderr，在后台线程中运行时不能访问Vim。
+    """
+    chunks = _split_chunks([str(f) for f in files])
+    tasks = [(c, pattern, enc, encodings.subset(c) if encodings else None, maxsize) for c in chunks]
+    # 结果仍按文件列表顺序、行号顺序排列
+    results = _map_chunks(_find_in_files, executor, tasks)
+    try:
+        for chunk, (msgs, failed, detected, nbytes) in zip(chunks, results):
+            if stats is not None:
+                stats.files += len(chunk)
+                stats.bytes += nbytes
+            if errors is not None:
+                errors += failed
+            else:
+                for fname in failed:
+                    print("file: %s" % fname, file=sys.stderr)
+            if encodings:
+                encodings.update(detected)
+            yield from msgs
+            if cancel is not None and cancel.is_set():
+                return
+    finally:
+        results.close()
+
 
+def find_pattern(files: list, pattern: str, enc, executor=None, encodings=None, maxsize=0):
+    """与find_matches相同，返回"文件名:行号:列号:行内容"格式的字符串"""
+    for match in find_matches(files, pattern, enc, executor, encodings, maxsize=maxsize):
+        yield "{0}:{1}:{2}:{3}".format(*match)
 
-def replace_pattern(files: list, pattern: str, to: str, enc):
-    ptn_from = re.compile(pattern.encode(enc))
+
+def _stream_replace(src, dst, fname, pattern, to, enc):
+    """逐行替换src并写入dst，返回报告行"""
+    ptn_from = _compile(pattern, enc, 0)
     ptn_to = to.encode(enc)
-    for fname in files:
-        lines = []
-        is_replaced = False
+    msgs = []
+    for i, line in enumerate(src):
+        rep = ptn_from.sub(ptn_to, line)
+        if rep != line:
+            msgs.append("{0}:{1}:{2}".format(
+                fname, i + 1, line.rstrip().decode(enc)))
+        dst.write(rep)
+    return msgs
+
+
+def _replace_file(fname, pattern, to, enc, known=None):
+    """替换一个文件，返回(报告行, 需要记录的编码信息, 读取的字节数)
+
+    替换结果先写入同一目录的临时文件，有改动时再改名覆盖原文件，中途出错不会破坏原文件。
+    与查找一样跳过二进制文件，但不限制文件大小：逐行替换不会占用很多内存，跳过的话会替换了一半。
+    """
+    real = os.path.realpath(fname)
+    msgs = []
+    entry = None
+    with open(real, 'rb') as src:
+        stamp = file_stamp(src.fileno())
+        size = stamp[1]
+        file_enc = _known_encoding(known, fname, stamp)
+        buf = _map_file(src)
         try:
-            with open(fname, 'rb') as fp:
-                for i, line in enumerate(fp):
-                    rep = ptn_from.sub(ptn_to, line)
-                    if rep != line:
-                        is_replaced = True
-                        lines.append(rep)
-                        yield "{0}:{1}:{2}".format(
-                            str(fname), i + 1, line.rstrip().decode(enc))
-                    else:
-                        lines.append(line)
-
-            if is_replaced:
-                with open(fname, 'wb') as fp:
-                    fp.writelines(lines)
+            if _is_binary(buf):
+                return msgs, entry, 0
+            if file_enc is None and not (pattern + to).isascii():
+                file_enc = _detect_encoding(buf, enc)
+                entry = list(stamp) + [file_enc]
+            needles, exact = literals(pattern, file_enc or enc)
+            if needles is not None and not any(buf.find(needle) >= 0 for needle in needles):
+                return msgs, entry, size
+
+            fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(real), prefix='.vprep')
+            try:
+                with os.fdopen(fd, 'wb') as dst:
+                    try:
+                        msgs = _stream_replace(src, dst, fname, pattern, to, file_enc or enc)
+                    except UnicodeDecodeError:
+                        if file_enc is not None:
+                            raise
+                        # 文件编码与项目编码不同，检测后重新替换
+                        file_enc = _detect_encoding(buf, enc)
+                        entry = list(stamp) + [file_enc]
+                        src.seek(0)
+                        dst.seek(0)
+                        dst.truncate()
+                        msgs = _stream_replace(src, dst, fname, pattern, to, file_enc)
+                if msgs:
+                    shutil.copymode(real, tmpname)
+            except BaseException:
+                os.remove(tmpname)
+                raise
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    # 原文件关闭后才能在Windows上覆盖
+    if msgs:
+        os.replace(tmpname, real)
+        if file_enc:
+            st = os.stat(real)
+            entry = [st.st_mtime_ns, st.st_size, file_enc]
+    else:
+        os.remove(tmpname)
+    return msgs, entry, size
+
 
+def _replace_in_files(files: list, pattern: str, to: str, enc, known=None):
+    """替换files中的内容，返回(报告行, 错误信息, 新检测到的文件编码, 读取的字节数)"""
+    msgs = []
+    errors = []
+    detected = {}
+    nbytes = 0
+    for fname in files:
+        try:
+            file_msgs, entry, size = _replace_file(fname, pattern, to, enc, known)
+            msgs.extend(file_msgs)
+            nbytes += size
+            if entry:
+                detected[fname] = entry
         except (IOError, FileExistsError, UnicodeError):
             import traceback
-            print(traceback.format_exc(), file=sys.stderr)
-            print("file: %s" % fname, file=sys.stderr)
+            errors.append(traceback.format_exc() + "file: %s" % fname)
+    return msgs, errors, detected, nbytes
+
+
+def replace_pattern(files: list, pattern: str, to: str, enc, executor=None, encodings=None, stats=None):
+    """encodings为EncodingCache时使用并更新其中记录的文件编码，stats与find_matches相同"""
+    chunks = _split_chunks([str(f) for f in files])
+    tasks = [(c, pattern, to, enc, encodings.subset(c) if encodings else None) for c in chunks]
+    for chunk, (msgs, errors, detected, nbytes) in zip(chunks, _map_chunks(_replace_in_files, executor, tasks)):
+        if stats is not None:
+            stats.files += len(chunk)
+            stats.bytes += nbytes
+        for error in errors:
+            print(error, file=sys.stderr)
+        if encodings:
+            encodings.update(detected)
+        yield from msgs
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import hashlib
+import marshal
+import os
+
+from fileutil import atomic_write, file_stamp
+
+_VERSION = 2
+
+
+class GrepCache(object):
+    """按(正则, 编码)缓存每个文件的搜索结果
+
+    每次搜索的结果保存为目录中的一个文件，内容为{路径: (修改时间, 大小, 结果)}，
+    结果为"行号:列号:行内容"用换行符连接起来的字符串，比每个结果一个元组读取得快。
+    再次搜索时只查找修改时间或大小变化了的文件。
+    文件的修改时间用来记录最近使用的时间，总大小超过limit字节时删除最久没有使用的结果。
+    salt为其他影响搜索结果的设置，salt不同时不使用以前的结果。
+    """
+
+    def __init__(self, dirname, limit, salt=''):
+        self.dirname = dirname
+        self.limit = limit
+        self.salt = salt
+
+    def entry_fname(self, pattern, enc):
+        key = '\0'.join([self.salt, enc, pattern])
+        key = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.dirname, key + '.tmp')
+
+    def load(self, pattern, enc):
+        fname = self.entry_fname(pattern, enc)
+        try:
+            with open(fname, 'rb') as fp:
+                version, key, files = marshal.load(fp)
+        except (IOError, EOFError, ValueError, TypeError):
+            return {}
+        if version != _VERSION or key != (pattern, enc, self.salt):
+            return {}
+        try:
+            os.utime(fname)
+        except OSError:
+            pass
+        return files
+
+    def save(self, pattern, enc, files):
+        if not os.path.isdir(self.dirname):
+            os.mkdir(self.dirname)
+        fname = self.entry_fname(pattern, enc)
+        with atomic_write(fname, 'wb') as fp:
+            marshal.dump((_VERSION, (pattern, enc, self.salt), files), fp)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.dirname):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def search(self, files, pattern, enc, search, stop=None, errors=None):
+        """与search(文件列表)的结果相同，按文件顺序返回(文件名, 行号, 列号, 行内容)
+
+        search只用来查找缓存失效的文件，必须按给出的顺序返回结果。
+        正常结束时保存结果；stop（threading.Event）被设置时不保存，errors中的文件不缓存。
+        """
+        cached = self.load(pattern, enc)
+        stamps = []
+        stale = []
+        for f in files:
+            path = str(f)
+            stamp = file_stamp(path)
+            old = cached.get(path)
+            hit = bool(old and stamp and old[0] == stamp[0] and old[1] == stamp[1])
+            if not hit:
+                stale.append(path)
+            stamps.append((path, stamp, hit))
+
+        result = {}
+        fresh = iter(search(stale))
+        try:
+            pending = next(fresh, None)
+            for path, stamp, hit in stamps:
+                if hit:
+                    old = result[path] = cached[path]
+                    if old[2]:
+                        for line in old[2].split('\n'):
+                            lnum, col, text = line.split(':', 2)
+                            yield path, int(lnum), int(col), text
+                    continue
+                # 新的结果中属于这个文件的部分
+                found = []
+                while pending is not None and pending[0] == path:
+                    found.append('%d:%d:%s' % pending[1:])
+                    yield pending
+                    pending = next(fresh, None)
+                if stamp:
+                    result[path] = (stamp[0], stamp[1], '\n'.join(found))
+        finally:
+            close = getattr(fresh, 'close', None)
+            if close:
+                close()
+        if stop is not None and stop.is_set():
+            return
+        for path in errors or ():
+            result.pop(path, None)
+        if stale or len(result) != len(cached):
+            self.save(pattern, enc, result)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import functools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 保留最近多少次命令的记录
+HISTORY_SIZE = 20
+
+
+class Phase(object):
+    """命令中的一个阶段：耗时、读取的文件数和字节数、子进程耗时"""
+
+    def __init__(self, name, depth=0):
+        self.name = name
+        self.depth = depth
+        self.seconds = 0.0
+        self.files = 0
+        self.bytes = 0
+        self.subprocess = 0.0
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'depth': self.depth,
+            'seconds': self.seconds,
+            'files': self.files,
+            'bytes': self.bytes,
+            'subprocess': self.subprocess,
+        }
+
+
+class Run(object):
+    """一次命令的记录"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.seconds = None
+        self.phases = []
+        self.stack = []
+
+    def to_dict(self):
+        return {
+            'command': self.name,
+            'started': self.started,
+            'seconds': self.seconds,
+            'phases': [p.to_dict() for p in self.phases],
+        }
+
+
+class Profiler(object):
+    """记录最近几次命令各阶段的耗时
+
+    当前的命令按线程记录，后台线程用attach()继续记录启动它的命令。
+    不在命令中时phase()什么都不记录。
+    """
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.runs = deque(maxlen=size)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @property
+    def current(self):
+        return getattr(self.local, 'run', None)
+
+    def start(self, name):
+        run = Run(name)
+        self.local.run = run
+        return run
+
+    def attach(self, run):
+        self.local.run = run
+
+    def finish(self, run):
+        run.seconds = time.perf_counter() - run.start
+        if self.current is run:
+            self.local.run = None
+        with self.lock:
+            self.runs.append(run)
+
+    @contextmanager
+    def command(self, name):
+        outer = self.current
+        if outer:
+            # 命令中调用的其他命令作为一个阶段
+            with self.phase(name) as phase:
+                yield phase
+            return
+        run = self.start(name)
+        try:
+            yield run
+        finally:
+            self.finish(run)
+
+    @contextmanager
+    def phase(self, name):
+        run = self.current
+        if not run:
+            yield Phase(name)
+            return
+        phase = Phase(name, len(run.stack))
+        run.phases.append(phase)
+        run.stack.append(phase)
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.seconds = time.perf_counter() - start
+            run.stack.pop()
+
+    def record(self, name, seconds, **counts):
+        """记录已经结束的阶段，如后台运行的编译"""
+        run = self.current
+        if run:
+            phase = Phase(name, len(run.stack))
+            phase.seconds = seconds
+            for key, value in counts.items():
+                setattr(phase, key, value)
+            run.phases.append(phase)
+
+    def to_list(self):
+        with self.lock:
+            return [run.to_dict() for run in self.runs]
+
+    def report(self):
+        lines = []
+        with self.lock:
+            runs = list(self.runs)
+        for run in runs:
+            lines.append('%s  %s  %.3fs' % (run.name, time.strftime('%H:%M:%S', time.localtime(run.started)),
+                                            run.seconds))
+            for p in run.phases:
+                extra = []
+                if p.files:
+                    extra.append('%d files' % p.files)
+                if p.bytes:
+                    extra.append('%.1f MB' % (p.bytes / 1e6))
+                if p.subprocess:
+                    extra.append('subprocess %.3fs' % p.subprocess)
+                lines.append('    %-30s %8.3fs  %s' % ('  ' * p.depth + p.name, p.seconds, ', '.join(extra)))
+        return '\n'.join(lines)
+
+
+def profiled(name):
+    """把方法记录为一个命令，所在对象的profiler属性为Profiler"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.command(name):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
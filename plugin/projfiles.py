@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import re
+import sys
+from fnmatch import fnmatch
+
+_WILDCARDS = set('*?[')
+
+# 每个目录中读取的忽略规则文件
+IGNORE_FILES = ('.gitignore', )
+# 版本管理工具的目录总是忽略，可以在EXCLUDE中用"!.git/"取消
+_VCS_DIRS = ['.git/', '.hg/', '.svn/']
+
+
+def _match_parts(parts, pats, prefix=False):
+    # prefix为True时判断parts能否是某个匹配路径的前缀
+    if not parts:
+        return prefix or all(p == '**' for p in pats)
+    if not pats:
+        return False
+    if pats[0] == '**':
+        return _match_parts(parts, pats[1:], prefix) or _match_parts(parts[1:], pats, prefix)
+    return fnmatch(parts[0], pats[0]) and _match_parts(parts[1:], pats[1:], prefix)
+
+
+def _match_link(parts, pats):
+    # parts的最后一项是否能由**以外的模式匹配，glob只在这种情况下进入符号链接的目录
+    if not pats:
+        return False
+    if pats[0] == '**':
+        return _match_link(parts, pats[1:]) or (len(parts) > 1 and _match_link(parts[1:], pats))
+    if not fnmatch(parts[0], pats[0]):
+        return False
+    return len(parts) == 1 or _match_link(parts[1:], pats[1:])
+
+
+def _rel_parts(path, root):
+    rel = os.path.relpath(path, root)
+    if rel == os.curdir:
+        return []
+    parts = rel.replace('\\', '/').split('/')
+    if parts[0] == os.pardir:
+        return None
+    return parts
+
+
+def _translate(pat):
+    """.gitignore中的通配符转换为正则，*和?不匹配/，**匹配任意层目录"""
+    res = []
+    i = 0
+    n = len(pat)
+    while i < n:
+        c = pat[i]
+        i += 1
+        if c == '*':
+            if pat.startswith('*/', i):
+                res.append('(?:.*/)?')
+                i += 2
+            elif pat.startswith('*', i):
+                res.append('.*')
+                i += 1
+            else:
+                res.append('[^/]*')
+        elif c == '?':
+            res.append('[^/]')
+        elif c == '[':
+            j = pat.find(']', i + 1 if pat.startswith(('!', '^'), i) else i)
+            if j < 0 or j == i:
+                res.append('\\[')
+            else:
+                body = pat[i:j]
+                i = j + 1
+                if body[0] in '!^':
+                    body = '^' + body[1:]
+                res.append('[%s]' % body.replace('\\', '\\\\'))
+        elif c == '\\' and i < n:
+            res.append(re.escape(pat[i]))
+            i += 1
+        else:
+            res.append(re.escape(c))
+    return ''.join(res)
+
+
+class IgnoreRules(object):
+    """一组.gitignore格式的规则，路径相对于base目录
+
+    后面的规则优先，"!"开头的规则表示不忽略，"/"结尾的规则只匹配目录，
+    除结尾外含有"/"的规则从base开始匹配，否则匹配任意层中的名字。
+    """
+
+    def __init__(self, base, lines):
+        self.base = base
+        self.prefix = os.path.join(base, '')
+        self.rules = []
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if not line.endswith('\\ '):
+                line = line.rstrip(' ')
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            elif line.startswith(('\\#', '\\!')):
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            anchored = '/' in line
+            regex = re.compile(_translate(line.lstrip('/')) + '$', re.S)
+            self.rules.append((regex, negate, dir_only, anchored))
+        self.rules.reverse()
+        # 大部分规则只匹配目录，判断文件时不必逐条检查
+        self.file_rules = [r for r in self.rules if not r[2]]
+
+    @classmethod
+    def from_file(cls, dirname, name):
+        try:
+            with open(os.path.join(dirname, name), encoding='utf-8', errors='replace') as fp:
+                rules = cls(dirname, fp)
+        except OSError:
+            return None
+        return rules if rules.rules else None
+
+    def match(self, path, is_dir):
+        """path被忽略时返回True，被"!"规则取消时返回False，没有匹配的规则时返回None"""
+        rel = None
+        for regex, negate, dir_only, anchored in self.rules if is_dir else self.file_rules:
+            if anchored:
+                if rel is None:
+                    rel = path[len(self.prefix):] if path.startswith(self.prefix) else os.path.relpath(path, self.base)
+                    rel = rel.replace('\\', '/')
+                matched = regex.match(rel)
+            else:
+                matched = regex.match(os.path.basename(path))
+            if matched:
+                return not negate
+        return None
+
+
+class PathFilter(object):
+    """判断文件或目录是否属于项目，与PATH和SUFFIX的glob规则一致
+
+    另外跳过被忽略的文件和目录：EXCLUDE中的规则相对于项目目录，
+    项目目录及其下各目录中的.gitignore只作用于所在的目录。
+    """
+
+    def __init__(self, basedir, path, suffix, exclude=(), ignore_files=IGNORE_FILES):
+        self.basedir = os.path.normpath(basedir)
+        self.exclude = IgnoreRules(self.basedir, _VCS_DIRS + list(exclude))
+        self.ignore_files = ignore_files
+        self.chains = {}
+        self.dirs_ignored = {}
+        self.specs = []
+        for ptn in path:
+            parts = [p for p in ptn.replace('\\', '/').split('/') if p and p != '.']
+            i = 0
+            while i < len(parts) and not _WILDCARDS.intersection(parts[i]):
+                i += 1
+            root = os.path.normpath(os.path.join(basedir, *parts[:i]))
+            self.specs.append((root, parts[i:]))
+        self.suffix = tuple(s.lower() for s in suffix)
+
+    def roots(self):
+        """需要遍历的最上层目录"""
+        roots = sorted(set(root for root, pats in self.specs))
+        ret = []
+        for root in roots:
+            if not any(_rel_parts(root, r) is not None for r in ret):
+                ret.append(root)
+        return ret
+
+    def _chain(self, path):
+        """作用于目录path中各项的规则：(全部规则，外层的在前), (判断目录时用的), (判断文件时用的)"""
+        chains = self.chains.get(path)
+        if chains is not None:
+            return chains
+        parent = os.path.dirname(path)
+        if path == self.basedir or parent == path or _rel_parts(path, self.basedir) is None:
+            # 项目目录以外不读取上层目录的规则
+            chain = (self.exclude, )
+        else:
+            chain = self._chain(parent)[0]
+        rules = [IgnoreRules.from_file(path, name) for name in self.ignore_files]
+        chain = chain + tuple(r for r in rules if r)
+        # 分别用于判断目录和文件，内层的在前
+        chains = self.chains[path] = (chain, tuple(reversed(chain)),
+                                      tuple(r for r in reversed(chain) if r.file_rules))
+        return chains
+
+    def has_file_rules(self, path):
+        """目录path中的文件是否可能被忽略，没有规则时遍历目录时不必逐个判断"""
+        return bool(self._chain(path)[2])
+
+    def ignored(self, path, is_dir=False):
+        """path本身是否被忽略，不检查上层目录"""
+        chains = self._chain(os.path.dirname(path))
+        for rules in chains[1] if is_dir else chains[2]:
+            ret = rules.match(path, is_dir)
+            if ret is not None:
+                return ret
+        return False
+
+    def dir_ignored(self, path):
+        """目录或者它的某个上层目录被忽略"""
+        ret = self.dirs_ignored.get(path)
+        if ret is None:
+            parts = _rel_parts(path, self.basedir)
+            if not parts:
+                # 项目目录本身和项目目录以外的目录
+                ret = False
+            else:
+                ret = self.dir_ignored(os.path.dirname(path)) or self.ignored(path, True)
+            self.dirs_ignored[path] = ret
+        return ret
+
+    def match_dir(self, path):
+        """目录中的文件是否属于项目"""
+        if self.dir_ignored(path):
+            return False
+        return self._match_dir(path)
+
+    def _match_dir(self, path):
+        for root, pats in self.specs:
+            parts = _rel_parts(path, root)
+            if parts is not None and _match_parts(parts, pats):
+                return True
+        return False
+
+    def may_contain(self, path):
+        """目录下是否可能有属于项目的子目录"""
+        if self.dir_ignored(path):
+            return False
+        for root, pats in self.specs:
+            parts = _rel_parts(path, root)
+            if parts is None:
+                if _rel_parts(root, path) is not None:
+                    return True
+            elif _match_parts(parts, pats, True):
+                return True
+        return False
+
+    def follow_link(self, path):
+        """是否进入符号链接的目录path，与glob相同：**不进入，其他模式进入"""
+        for root, pats in self.specs:
+            parts = _rel_parts(path, root)
+            if parts and _match_link(parts, pats):
+                return True
+        return False
+
+    def enter(self, entry):
+        """遍历时是否进入目录entry（os.DirEntry）"""
+        if entry.is_symlink() and not self.follow_link(entry.path):
+            return False
+        return self.match_dir(entry.path) or self.may_contain(entry.path)
+
+    def match_suffix(self, name):
+        return name.lower().endswith(self.suffix)
+
+    def match_file(self, path):
+        return (self.match_suffix(os.path.basename(path)) and self.match_dir(os.path.dirname(path))
+                and not self.ignored(path))
+
+
+def walk_files(filt):
+    """遍历项目文件，每个目录只读取一次，按目录顺序返回文件路径"""
+    for root in filt.roots():
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                with os.scandir(path) as it:
+                    entries = sorted(it, key=lambda e: e.name)
+            except OSError:
+                continue
+            match_dir = filt.match_dir(path)
+            check = match_dir and filt.has_file_rules(path)
+            subdirs = []
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    if filt.enter(entry):
+                        subdirs.append(entry.path)
+                elif match_dir and filt.match_suffix(entry.name) and not (check and filt.ignored(entry.path)):
+                    yield entry.path
+            stack.extend(reversed(subdirs))
+
+
+class FileSet(object):
+    """项目文件的集合，去重并保持加入的顺序
+
+    basedir下的文件只保存相对路径的字符串（intern过），比保存Path对象节省很多内存。
+    迭代时返回绝对路径的字符串。
+    """
+
+    def __init__(self, basedir, paths=()):
+        self.prefix = os.path.join(os.path.abspath(basedir), '')
+        self.items = {}
+        self.update(paths)
+
+    def _key(self, path):
+        path = os.path.normpath(os.fspath(path))
+        if path.startswith(self.prefix):
+            path = path[len(self.prefix):]
+        return sys.intern(path)
+
+    def _path(self, key):
+        return key if os.path.isabs(key) else self.prefix + key
+
+    def add(self, path):
+        self.items[self._key(path)] = None
+
+    def update(self, paths):
+        key = self._key
+        self.items.update((key(p), None) for p in paths)
+
+    def discard(self, path):
+        self.items.pop(self._key(path), None)
+
+    def discard_trees(self, paths):
+        """去掉paths中各目录下的所有文件"""
+        prefixes = tuple(os.path.join(self._key(p), '') for p in paths)
+        for k in [k for k in self.items if k.startswith(prefixes)]:
+            del self.items[k]
+
+    def copy(self):
+        ret = FileSet.__new__(FileSet)
+        ret.prefix = self.prefix
+        ret.items = self.items.copy()
+        return ret
+
+    def __contains__(self, path):
+        return self._key(path) in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        prefix = self.prefix
+        for key in self.items:
+            yield key if os.path.isabs(key) else prefix + key
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import json
+import os
+import sys
+import threading
+import time
+
+from fileutil import file_stamp
+
+try:
+    import sqlite3
+except ImportError:
+    # 有的Vim使用的Python没有sqlite3，这时仍使用文本文件
+    sqlite3 = None
+
+_VERSION = 1
+
+_SCHEMA = [
+    'CREATE TABLE files (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, mtime INTEGER, size INTEGER)',
+    'CREATE TABLE encodings (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, encoding TEXT)',
+    'CREATE TABLE tags (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, digest TEXT)',
+    'CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)',
+]
+
+
+class ProjectState(object):
+    """项目状态数据库：文件列表、检测到的文件编码、tags的增量记录，以及tags和索引的生成时间
+
+    每个项目一个SQLite文件，放在项目的临时目录中。文件列表按加入的顺序保存，
+    监视线程发现的变化只增删对应的行。可以在多个线程中使用。
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = threading.Lock()
+        try:
+            self.db = self._open()
+        except sqlite3.OperationalError:
+            # 例如另一个Vim正在写入时的"database is locked"，文件本身没有问题
+            raise
+        except sqlite3.DatabaseError:
+            # 文件损坏时重新建立，里面只有可以重新生成的内容
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(fname + suffix)
+                except FileNotFoundError:
+                    pass
+            self.db = self._open()
+
+    def _open(self):
+        db = sqlite3.connect(self.fname, check_same_thread=False)
+        try:
+            return self._init(db)
+        except BaseException:
+            db.close()
+            raise
+
+    def _init(self, db):
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        if db.execute('PRAGMA user_version').fetchone()[0] != _VERSION:
+            with db:
+                for (name, ) in db.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall():
+                    db.execute('DROP TABLE %s' % name)
+                for sql in _SCHEMA:
+                    db.execute(sql)
+                db.execute('PRAGMA user_version=%d' % _VERSION)
+        return db
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE key=?', (key, )).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, json.dumps(value)))
+
+    def mark_built(self, key, files):
+        """记录tags或索引的生成时间和文件数"""
+        self.set_meta(key, {'time': time.time(), 'files': files})
+
+    def files(self):
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT path FROM files ORDER BY id')]
+
+    def file_count(self):
+        with self.lock:
+            return self.db.execute('SELECT count(*) FROM files').fetchone()[0]
+
+    def file_stamp(self, path):
+        """上次记录的(修改时间, 大小)，不在列表中时返回None"""
+        with self.lock:
+            return self.db.execute('SELECT mtime, size FROM files WHERE path=?', (path, )).fetchone()
+
+    def replace_files(self, paths):
+        rows = [(path, ) + (file_stamp(path) or (None, None)) for path in paths]
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM files')
+            self.db.executemany('INSERT OR IGNORE INTO files (path, mtime, size) VALUES (?, ?, ?)', rows)
+
+    def update_files(self, added, removed=(), removed_dirs=()):
+        """增删文件，removed_dirs中目录下的文件全部删除"""
+        rows = [(path, ) + (file_stamp(path) or (None, None)) for path in added]
+        with self.lock, self.db:
+            self.db.executemany('DELETE FROM files WHERE path=?', ((p, ) for p in removed))
+            for d in removed_dirs:
+                # 用path上的索引按前缀范围删除
+                prefix = d.rstrip('/\\') + '/'
+                self.db.execute('DELETE FROM files WHERE path >= ? AND path < ?', (prefix, prefix[:-1] + '0'))
+            self.db.executemany('INSERT OR IGNORE INTO files (path, mtime, size) VALUES (?, ?, ?)', rows)
+
+    def encodings(self):
+        with self.lock:
+            return {row[0]: list(row[1:]) for row in self.db.execute('SELECT * FROM encodings')}
+
+    def save_encodings(self, entries):
+        """entries为{路径: [修改时间, 大小, 编码]}，只写入这些记录"""
+        with self.lock, self.db:
+            self.db.executemany('INSERT OR REPLACE INTO encodings VALUES (?, ?, ?, ?)',
+                                ((path, ) + tuple(entry) for path, entry in entries.items()))
+
+    def tag_entries(self):
+        """tags增量生成的记录{路径: [修改时间, 大小, md5]}，没有生成过时返回None"""
+        if self.get_meta('tags') is None:
+            return None
+        with self.lock:
+            return {row[0]: list(row[1:]) for row in self.db.execute('SELECT * FROM tags')}
+
+    def save_tag_entries(self, entries):
+        with self.lock, self.db:
+            old = {row[0]: list(row[1:]) for row in self.db.execute('SELECT * FROM tags')}
+            self.db.executemany('DELETE FROM tags WHERE path=?', ((p, ) for p in old if p not in entries))
+            self.db.executemany('INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?)',
+                                ((p, ) + tuple(e) for p, e in entries.items() if old.get(p) != e))
+        self.mark_built('tags', len(entries))
+
+
+def open_state(fname):
+    """打开项目状态数据库，没有sqlite3或者无法打开时返回None"""
+    if sqlite3 is None:
+        return None
+    try:
+        return ProjectState(fname)
+    except (sqlite3.Error, OSError) as e:
+        print("cannot open %s: %s" % (fname, e), file=sys.stderr)
+        return None
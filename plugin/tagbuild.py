@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import os
+import json
+import heapq
+import hashlib
+from itertools import chain
+from subprocess import Popen
+
+from fileutil import atomic_write, file_stamp, temp_fname
+
+CTAGS_ARGS = ['--c-kinds=+px', '--c++-kinds=+px', '--fields=+iaS', '--extras=+q']
+
+
+def file_digest(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class TagState(object):
+    """上次生成tags时每个文件的{路径: [修改时间, 大小, md5]}
+
+    全量生成时不计算md5，只在文件的修改时间或大小变化后才计算，用于排除只是被touch过的文件。
+    store为statedb.ProjectState时保存在其中，否则保存为json文件fname。
+    """
+
+    def __init__(self, fname, store=None):
+        self.fname = fname
+        self.store = store
+        self.entries = None
+
+    def load(self):
+        if self.store:
+            self.entries = self.store.tag_entries()
+            if self.entries is not None:
+                return True
+        try:
+            with open(self.fname, encoding='utf-8') as fp:
+                self.entries = json.load(fp)
+        except (IOError, ValueError):
+            self.entries = None
+        return self.entries is not None
+
+    def save(self):
+        if self.store:
+            self.store.save_tag_entries(self.entries)
+            return
+        with atomic_write(self.fname, encoding='utf-8') as fp:
+            json.dump(self.entries, fp)
+
+    def reset(self, files):
+        self.entries = {}
+        for path in files:
+            stamp = file_stamp(path)
+            if stamp:
+                self.entries[path] = list(stamp) + [None]
+
+    def diff(self, files):
+        """与当前文件比较，返回(新增或修改的文件, 删除或修改的文件)，并更新记录
+
+        必须在对这些文件运行ctags之前调用，记录的修改时间不能晚于生成tag时读到的内容。
+        """
+        changed = []
+        entries = {}
+        for path in files:
+            stamp = file_stamp(path)
+            if stamp is None:
+                continue
+            stamp = list(stamp)
+            entry = self.entries.get(path)
+            if entry and entry[:2] == stamp:
+                entries[path] = entry
+                continue
+            try:
+                digest = file_digest(path)
+            except IOError:
+                continue
+            entries[path] = stamp + [digest]
+            if not entry or entry[2] != digest:
+                changed.append(path)
+        stale = set(self.entries) - set(entries)
+        stale.update(p for p in changed if p in self.entries)
+        self.entries = entries
+        return changed, stale
+
+
+def _tag_file(line):
+    parts = line.split(b'\t', 2)
+    return parts[1] if len(parts) > 2 else None
+
+
+def _open_tags(fname, drop=None):
+    """返回(文件头, 按顺序排列的tag行的迭代器)，drop中文件的tag被去掉"""
+    if not os.path.exists(fname):
+        return [], iter([])
+    fp = open(fname, 'rb')
+    headers = []
+    first = []
+    for line in fp:
+        if line.startswith(b'!_'):
+            headers.append(line)
+        else:
+            first.append(line)
+            break
+
+    def lines():
+        with fp:
+            for line in chain(first, fp):
+                if not drop or _tag_file(line) not in drop:
+                    yield line
+
+    return headers, lines()
+
+
+def _write_merged(tags_fname, sources):
+    """把若干已排序的tags文件归并写入tags_fname，sources为(文件名, 要去掉的文件)的列表"""
+    opened = [_open_tags(fname, drop) for fname, drop in sources]
+    headers = next((h for h, lines in opened if h), [])
+    with atomic_write(tags_fname, 'wb') as fp:
+        fp.writelines(headers)
+        # Vim按二分查找tags文件，各部分都已排好序，归并即可
+        fp.writelines(heapq.merge(*[lines for h, lines in opened]))
+
+
+def build_tags(files, tags_fname, jobs=1):
+    """对files运行ctags，结果写入tags_fname
+
+    jobs大于1时把文件分成多份同时运行ctags，再归并各自的结果。
+    tags_fname在全部完成后才被替换，返回ctags的返回值。
+    """
+    jobs = max(1, min(jobs, len(files) // 100))
+    size = -(-len(files) // jobs) if files else 1
+    shards = [files[i:i + size] for i in range(0, len(files), size)] or [[]]
+    base = temp_fname(tags_fname)
+    procs = []
+    try:
+        for i, shard in enumerate(shards):
+            with open('%s%d.list' % (base, i), 'w') as fp:
+                for path in shard:
+                    print(path, file=fp)
+            procs.append(Popen(['ctags'] + CTAGS_ARGS +
+                               ['-L', '%s%d.list' % (base, i), '-f', '%s%d' % (base, i)]))
+        ret = max(p.wait() for p in procs)
+        if ret == 0:
+            _write_merged(tags_fname, [('%s%d' % (base, i), None) for i in range(len(shards))])
+        return ret
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.kill()
+        for fname in [base] + ['%s%d%s' % (base, i, ext) for i in range(len(shards)) for ext in ('.list', '')]:
+            if os.path.exists(fname):
+                os.remove(fname)
+
+
+def update_tags(files, tags_fname, state_fname, jobs=1, store=None):
+    """只对新增或修改的文件运行ctags，合并到已有的tags文件中
+
+    files中的路径必须与文件列表中的写法一致，它们也是tags文件中的文件名。
+    没有上次的记录或tags文件时全量生成。记录保存的位置与TagState相同。
+    """
+    state = TagState(state_fname, store)
+    if not state.load() or not os.path.exists(tags_fname):
+        # 运行ctags之前记录，期间被修改的文件下次会重新生成
+        state.reset(files)
+        ret = build_tags(files, tags_fname, jobs)
+        if ret == 0:
+            state.save()
+        return ret
+
+    changed, stale = state.diff(files)
+    ret = 0
+    if changed or stale:
+        new_fname = temp_fname(tags_fname)
+        try:
+            if changed:
+                ret = build_tags(changed, new_fname, jobs)
+                if ret != 0:
+                    # 记录不更新，下次重新生成这些文件的tag
+                    return ret
+            drop = set(os.fsencode(p) for p in stale)
+            _write_merged(tags_fname, [(tags_fname, drop), (new_fname, None)])
+        finally:
+            if os.path.exists(new_fname):
+                os.remove(new_fname)
+    state.save()
+    return ret
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import sys
+import marshal
+from array import array
+
+from fileutil import atomic_write, file_stamp
+
+_VERSION = 1
+
+# 每次计算这么多字节的三元组，大文件分段处理，避免建立索引的线程长时间占用GIL
+_CHUNK = 256 * 1024
+
+
+def _trigrams(data):
+    # 纯Python中zip生成元组是最快的方法，每个字节都要生成一个对象，所以索引默认不启用
+    if len(data) <= _CHUNK:
+        return set(zip(data, data[1:], data[2:]))
+    ret = set()
+    for i in range(0, len(data) - 2, _CHUNK):
+        # 相邻两段重叠两个字节，跨段的三元组不会遗漏
+        part = data[i:i + _CHUNK + 2]
+        ret.update(zip(part, part[1:], part[2:]))
+    return ret
+
+
+class TrigramIndex(object):
+    """项目文件的三元组倒排索引，用于在grep之前排除不可能匹配的文件"""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.stamp = None
+        self.files = {}
+        self.postings = {}
+
+    def build(self, files):
+        stats = []
+        postings = {}
+        for fname in files:
+            fname = str(fname)
+            stat = file_stamp(fname)
+            if stat is None:
+                continue
+            try:
+                with open(fname, 'rb') as fp:
+                    data = fp.read()
+            except IOError:
+                print("file: %s" % fname, file=sys.stderr)
+                continue
+            fid = len(stats)
+            stats.append((fname, ) + stat)
+            for tri in _trigrams(data):
+                if tri in postings:
+                    postings[tri].append(fid)
+                else:
+                    postings[tri] = array('I', [fid])
+
+        with atomic_write(self.fname, 'wb') as fp:
+            marshal.dump((_VERSION, stats, {k: v.tobytes() for k, v in postings.items()}), fp)
+        self.stamp = None
+
+    def load(self):
+        stat = file_stamp(self.fname)
+        if stat is None:
+            self.stamp = None
+            self.files = {}
+            self.postings = {}
+            return False
+        if stat == self.stamp:
+            return True
+        try:
+            with open(self.fname, 'rb') as fp:
+                version, stats, postings = marshal.load(fp)
+        except (IOError, EOFError, ValueError, TypeError):
+            return False
+        if version != _VERSION:
+            return False
+        self.files = {s[0]: (fid, s[1:]) for fid, s in enumerate(stats)}
+        self.postings = postings
+        self.stamp = stat
+        return True
+
+    def _lookup(self, needle):
+        ids = None
+        for tri in _trigrams(needle):
+            if tri not in self.postings:
+                return set()
+            posting = array('I')
+            posting.frombytes(self.postings[tri])
+            ids = set(posting) if ids is None else ids.intersection(posting)
+            if not ids:
+                break
+        return ids
+
+    def candidates(self, files, needles):
+        """返回files中可能包含needles中任意一个字符串的文件，保持原有顺序
+
+        不在索引中或自建立索引后被修改过的文件总是保留。
+        """
+        if not needles or min(len(n) for n in needles) < 3 or not self.load():
+            return list(files)
+        ids = set()
+        for needle in needles:
+            ids.update(self._lookup(needle))
+
+        ret = []
+        for fname in files:
+            info = self.files.get(str(fname))
+            if info is None or info[0] in ids or file_stamp(fname) != info[1]:
+                ret.append(fname)
+        return ret
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+import sys
+import time
+
+
+class VimBridge(object):
+    """vimproject访问Vim的唯一入口
+
+    queue()放入的命令在下一次command、eval、call或flush时用一次execute()全部执行，
+    减少Python与Vim之间的来回调用。execute()会截获命令的输出，需要显示信息的命令用command()。
+    每个调用点（调用者的函数名）的调用次数和耗时记录在stats中。
+    """
+
+    def __init__(self, vim):
+        self.vim = vim
+        self.pending = []
+        self.functions = {}
+        self.stats = {}
+
+    def _record(self, kind, site, start):
+        key = '%s %s' % (kind, site)
+        stat = self.stats.get(key)
+        if stat is None:
+            stat = self.stats[key] = [0, 0.0]
+        stat[0] += 1
+        stat[1] += time.perf_counter() - start
+
+    def _flush(self, site):
+        if not self.pending:
+            return
+        cmds, self.pending = self.pending, []
+        start = time.perf_counter()
+        try:
+            if len(cmds) == 1:
+                self.vim.command(cmds[0])
+            else:
+                self._function('execute')(cmds)
+        finally:
+            self._record('flush', site, start)
+
+    def _function(self, name):
+        func = self.functions.get(name)
+        if func is None:
+            func = self.functions[name] = self.vim.Function(name)
+        return func
+
+    def queue(self, cmd):
+        self.pending.append(cmd)
+
+    def flush(self):
+        self._flush(sys._getframe(1).f_code.co_name)
+
+    def command(self, cmd):
+        site = sys._getframe(1).f_code.co_name
+        self._flush(site)
+        start = time.perf_counter()
+        try:
+            self.vim.command(cmd)
+        finally:
+            self._record('command', site, start)
+
+    def eval(self, expr):
+        return self._eval(expr, sys._getframe(1).f_code.co_name)
+
+    def _eval(self, expr, site):
+        self._flush(site)
+        start = time.perf_counter()
+        try:
+            return self.vim.eval(expr)
+        finally:
+            self._record('eval', site, start)
+
+    def call(self, name, *args):
+        site = sys._getframe(1).f_code.co_name
+        self._flush(site)
+        start = time.perf_counter()
+        try:
+            return self._function(name)(*args)
+        finally:
+            self._record('call', site, start)
+
+    def any_valid_quickfix(self):
+        """当前quickfix列表中是否有有效条目，在Vim中判断，不把整个列表转换到Python"""
+        return int(self._eval("!empty(filter(getqflist(), 'v:val.valid'))", sys._getframe(1).f_code.co_name))
+
+    def report(self):
+        lines = ['%-40s %8s %10s' % ('call site', 'calls', 'time(ms)')]
+        for key, (count, seconds) in sorted(self.stats.items(), key=lambda kv: -kv[1][1]):
+            lines.append('%-40s %8d %10.2f' % (key, count, seconds * 1000))
+        return '\n'.join(lines)
+
+    def reset_stats(self):
+        self.stats = {}
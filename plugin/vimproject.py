@@ -2,20 +2,40 @@
 # -*- coding: utf-8 -*-
 
 import hashlib
+import json
 import os
+import re
 import shutil
 import sys
 import tempfile
+import threading
+import time
+import traceback
 from copy import copy
+from itertools import islice
 from pathlib import Path
-from subprocess import Popen, call
+from subprocess import Popen
 
 import vim
 import vimrecoding
-from findrep import find_pattern, replace_pattern
-
-IS_WIN = int(vim.eval('has("win32")'))
-IS_GUI = int(vim.eval('has("gui")'))
+from vimbridge import VimBridge
+from findrep import find_matches, is_broken, literals, make_executor, replace_pattern
+from trigram import TrigramIndex
+from asyncjob import AsyncJob, ThreadJob
+from enccache import EncodingCache
+from fileutil import atomic_write, file_stamp, temp_fname
+from grepcache import GrepCache
+from efmparse import ErrorParser, quickfix_items
+from tagbuild import build_tags, update_tags
+from filewatch import start_watcher
+from projfiles import IGNORE_FILES, FileSet, PathFilter, walk_files
+from profiler import Phase, Profiler, profiled
+from statedb import open_state
+
+vimb = VimBridge(vim)
+
+IS_WIN = int(vimb.eval('has("win32")'))
+IS_GUI = int(vimb.eval('has("gui")'))
 
 #对于不同编译器的不同错误信息格式，第一项为错误，第二项为警告
 _COMPILER_EFM = {
@@ -168,6 +188,13 @@ _COMPILER_EFM = {
 }
 
 
+# 搜索结果文件的格式：文件名:行号:列号:内容，替换的结果没有列号
+_GREP_LINE = re.compile(r'^(.*?):(\d+):(?:(\d+):)?(.*)$')
+
+# 每次传给setqflist的条目数
+QF_BATCH = 5000
+
+
 def formpath(p):
     if not isinstance(p, str):
         p = str(p)
@@ -183,6 +210,11 @@ def str2vimfmt(s):
     return ''.join(ret)
 
 
+def grep_item(match):
+    """find_matches的结果转换为quickfix条目"""
+    return {'filename': match[0], 'lnum': match[1], 'col': match[2], 'text': match[3]}
+
+
 def escape_text(text):
     if IS_WIN:
         return text
@@ -192,15 +224,45 @@ def escape_text(text):
 
 class VimProject(object):
     def __init__(self):
+        self.profiler = Profiler()
+        self.state = None
+        self.executor = None
+        self.executor_workers = 0
+        self.executor_failed = False
+        self.watcher = None
+        self.build_job = None
+        self.build_timer = None
+        self.build_qfid = 0
+        self.build_parser = None
+        self.parsers = {}
+        self.build_records = []
+        self.build_recoder = None
+        self.make_records = None
+        self.make_key = None
+        self.update_thread = None
+        self.update_timer = None
+        self.update_status = ''
+        self.update_shown = ''
+        self.update_error = None
+        self.cscope_error = None
+        self.cscope_new = None
+        self.update_run = None
+        self.grep_qfid = 0
+        self.grep_shown = 0
+        self.grep_total = 0
+        self.grep_job = None
+        self.grep_timer = None
+        self.grep_stats = None
+        self.grep_errors = []
         self.reset_config()
         self.commit_settings()
 
     def reset_config(self):
-        ext = vim.eval('''expand('%:e')''')
+        ext = vimb.eval('''expand('%:e')''')
         if not ext:
             ext = ''
         self.projectname = ''
-        self.basedir = formpath(vim.eval('getcwd()'))
+        self.basedir = formpath(vimb.eval('getcwd()'))
         self.path = ['.']
         self.suffix = ['.' + ext]
         self.make = ''
@@ -208,7 +270,7 @@ class VimProject(object):
         self.rebuild = ''
         self.execute = ''
         self.execpath = self.basedir
-        self.files = []
+        self.files = FileSet(self.basedir)
         self.compiler = []
         self.type = ''
         self.warning = False
@@ -218,6 +280,18 @@ class VimProject(object):
         self.projectfile = ""
         self.vimcmd = ""
         self.encoding = 'utf-8'
+        self.grepjobs = 0
+        self.index = 0
+        self.watch = 0
+        self.asyncmake = 0
+        self.asyncgrep = 0
+        self.inctags = 1
+        self.tagjobs = 0
+        self.greplimit = 10000
+        self.grepcache = 64
+        self.exclude = []
+        self.gitignore = 1
+        self.maxfilesize = 16
 
     def from_file(self, fname):
         fpproj = Path(fname).absolute()
@@ -229,6 +303,8 @@ class VimProject(object):
         except Exception as e:
             print(str(e), file=sys.stderr)
             return
+        # 后台的搜索、更新和监视线程读取当前项目的设置，必须在替换设置之前结束它们
+        self.stop_jobs()
         self.reset_config()
         self.projectfile = fpproj
         self.projectname = fpproj.stem
@@ -292,6 +368,30 @@ class VimProject(object):
             self.vimcmd = gl['VIMCMD']
         if 'ENCODING' in gl:
             self.encoding = gl['ENCODING']
+        if 'GREPJOBS' in gl:
+            self.grepjobs = gl['GREPJOBS']
+        if 'INDEX' in gl:
+            self.index = gl['INDEX']
+        if 'WATCH' in gl:
+            self.watch = gl['WATCH']
+        if 'ASYNCMAKE' in gl:
+            self.asyncmake = gl['ASYNCMAKE']
+        if 'ASYNCGREP' in gl:
+            self.asyncgrep = gl['ASYNCGREP']
+        if 'INCTAGS' in gl:
+            self.inctags = gl['INCTAGS']
+        if 'TAGJOBS' in gl:
+            self.tagjobs = gl['TAGJOBS']
+        if 'GREPLIMIT' in gl:
+            self.greplimit = gl['GREPLIMIT']
+        if 'GREPCACHE' in gl:
+            self.grepcache = gl['GREPCACHE']
+        if 'EXCLUDE' in gl:
+            self.exclude = gl['EXCLUDE']
+        if 'GITIGNORE' in gl:
+            self.gitignore = gl['GITIGNORE']
+        if 'MAXFILESIZE' in gl:
+            self.maxfilesize = gl['MAXFILESIZE']
 
         self.commit_settings()
 
@@ -321,6 +421,21 @@ class VimProject(object):
     def get_session_fname(self):
         return self.get_fname_base() + '.session.tmp'
 
+    def get_index_fname(self):
+        return self.get_fname_base() + '.index.tmp'
+
+    def get_encoding_fname(self):
+        return self.get_fname_base() + '.enc.tmp'
+
+    def get_tagstate_fname(self):
+        return self.get_fname_base() + '.tagstate.tmp'
+
+    def get_grepcache_dir(self):
+        return self.get_fname_base() + '.grepcache'
+
+    def get_state_fname(self):
+        return self.get_fname_base() + '.state.db'
+
     def add_library_tags(self):
         if not self.libtags:
             return
@@ -333,54 +448,148 @@ class VimProject(object):
             inc = os.environ.get("CPLUS_INCLUDE_PATH", None)
             if inc:
                 ret += list(map(formpath, inc.split(os.pathsep)))
-        for dir in ret:
-            vim.command('silent set tags+=%s/tags' % str2vimfmt(dir))
+        if ret:
+            vimb.queue('silent set tags+=%s' % ','.join(str2vimfmt(dir + '/tags') for dir in ret))
 
     def add_cscope_database(self):
         if self.type in ['c', 'cpp', 'java']:
-            vim.command('silent! cs add %s %s' % (str2vimfmt(self.get_cscope_fname()), str2vimfmt(self.basedir)))
+            vimb.queue('silent! cs add %s %s' % (str2vimfmt(self.get_cscope_fname()), str2vimfmt(self.basedir)))
 
     def load_session_file(self):
         session = self.get_session_fname()
         if self.projectfile and Path(session).is_file():
-            vim.command(r'''silent so %s''' % str2vimfmt(session))
+            vimb.command(r'''silent so %s''' % str2vimfmt(session))
 
     def write_session_file(self):
         if self.projectfile:
             session_fname = self.get_session_fname()
-            vim.command(r'''silent mks! %s''' % str2vimfmt(session_fname))
+            vimb.command(r'''silent mks! %s''' % str2vimfmt(session_fname))
 
     def save_all(self):
-        vim.command("wall")
+        with self.profiler.phase('save_all'):
+            vimb.command("wall")
 
     def load_files(self):
-        f = Path(self.get_file_list())
-        if not f.exists():
+        fname = self.get_file_list()
+        mtime = file_stamp(fname)
+        mtime = mtime and mtime[0]
+        if self.state and self.state.file_count() and (not mtime or mtime <= self.state.get_meta('list_mtime', 0)):
+            self.files = FileSet(self.basedir, self.state.files())
+            return
+        if not mtime:
             return
 
-        with open(f) as fp:
-            for line in fp:
-                self.files.append(Path(line.strip()))
+        # 没有数据库，或者文件列表被VPEditFileListFile修改过
+        with open(fname) as fp:
+            self.files = FileSet(self.basedir, (line.strip() for line in fp if line.strip()))
+        if self.state:
+            self.state.replace_files(formpath(f) for f in self.files)
+            self.state.set_meta('list_mtime', mtime)
+
+    def get_executor(self):
+        workers = self.grepjobs or os.cpu_count() or 1
+        # 文件数较少时启动工作进程反而更慢
+        if workers <= 1 or len(self.files) < 1000:
+            return None
+        if self.executor and is_broken(self.executor):
+            # 工作进程出错时查找已经改在当前进程中完成，以后也不再使用工作进程
+            print("Worker processes failed, searching in Vim's process.", file=sys.stderr)
+            self.close_executor()
+            self.executor_failed = True
+        if self.executor_failed:
+            return None
+        if self.executor and self.executor_workers != workers:
+            self.close_executor()
+        if not self.executor:
+            self.executor = make_executor(workers)
+            self.executor_workers = workers
+        return self.executor
+
+    def close_executor(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def start_watcher(self):
+        self.stop_watcher()
+        if self.watch and self.projectfile:
+            filt = self.make_filter()
+            self.watcher = start_watcher(filt, self.on_files_changed)
+
+    def stop_watcher(self, wait=True):
+        if self.watcher:
+            self.watcher.stop(wait)
+            self.watcher = None
+
+    def on_files_changed(self, added, removed, removed_dirs, reset=False):
+        # 在监视线程中调用，只能整体替换self.files
+        files = FileSet(self.basedir) if reset else self.files.copy()
+        for path in removed:
+            files.discard(path)
+        if removed_dirs:
+            files.discard_trees(removed_dirs)
+        files.update(added)
+        self.files = files
+        if self.state:
+            # 只更新变化的文件，文件列表在需要时再写出
+            if reset:
+                self.state.replace_files(formpath(p) for p in files)
+            else:
+                self.state.update_files([formpath(p) for p in added], [formpath(p) for p in removed],
+                                        [formpath(p) for p in removed_dirs])
+        else:
+            self.write_file_list()
+
+    def close(self):
+        self.write_session_file()
+        self.cancel_build()
+        self.stop_grep()
+        # 退出Vim时不等待监视线程
+        self.stop_watcher(False)
+        self.close_executor()
+        self.close_state()
+
+    def close_state(self):
+        if self.state:
+            self.state.close()
+            self.state = None
+
+    def stop_jobs(self):
+        self.stop_grep()
+        self.wait_update()
+        self.stop_watcher()
 
     def commit_settings(self):
         self.tempdir = Path(
             tempfile.gettempdir()) / ("vimproject_" + hashlib.md5(self.basedir.encode("utf-8")).hexdigest()[:10])
-        vim.command('''silent set path=.,%s''' % (','.join([
+        self.close_state()
+        if self.projectfile:
+            # 没有项目文件时仍只使用文本文件
+            self.state = open_state(self.get_state_fname())
+        self.trigram = TrigramIndex(self.get_index_fname())
+        self.encodings = EncodingCache(self.get_encoding_fname(), self.state)
+        # GREPCACHE为缓存的大小上限（MB），0表示不缓存
+        self.grep_cache = GrepCache(self.get_grepcache_dir(), self.grepcache * 1024 * 1024, str(self.get_maxsize()))
+        vimb.queue('''silent set path=.,%s''' % (','.join([
             str2vimfmt(p if Path(p).is_absolute() else str(Path(self.basedir + '/' + p).absolute())) for p in self.path
         ])))
-        vim.command('silent set tags=%s' % ','.join(map(str2vimfmt, [self.get_tags_fname()] + self.tags)))
+        vimb.queue('silent set tags=%s' % ','.join(map(str2vimfmt, [self.get_tags_fname()] + self.tags)))
         self.load_files()
         self.add_library_tags()
         self.add_cscope_database()
         if self.vimcmd:
-            vim.command(self.vimcmd)
+            vimb.command(self.vimcmd)
+        vimb.flush()
+        self.start_watcher()
 
     def open_quickfix(self):
-        vim.command("execute 'botright copen 10'")
-        if not self.is_error_in_quickfix():
-            vim.command("execute 'normal G'")
-        vim.command('wincmd p')
-        # vim.command('silent! lcd ' + str2vimfmt(self.basedir))
+        error = self.is_error_in_quickfix()
+        vimb.queue("botright copen 10")
+        if not error:
+            vimb.queue("normal G")
+        vimb.queue('wincmd p')
+        vimb.flush()
+        # vimb.command('silent! lcd ' + str2vimfmt(self.basedir))
 
     def async_run(self, cmd, qffile=None):
         cwd = Path.cwd()
@@ -394,38 +603,133 @@ class VimProject(object):
             else:
                 vim_cmd = 'sh -c \'{cmd}\' >"{qffile}" 2>&1'.format(cmd=cmd, qffile=qffile)
 
-            os.system(vim_cmd)
+            with self.profiler.phase('build') as phase:
+                os.system(vim_cmd)
+            phase.subprocess = phase.seconds
 
             if qffile and Path(qffile).exists():
-                enc = vim.eval("&encoding")
-                vimrecoding.recode_file(qffile, enc)
-                self.load_quickfix_file(qffile, self.buildpath)
+                enc = vimb.eval("&encoding")
+                with self.profiler.phase('recode') as phase:
+                    vimrecoding.recode_file(qffile, enc, self.encodings)
+                    self.encodings.save()
+                    phase.files = 1
+                    phase.bytes = os.path.getsize(qffile)
+                self.show_make_result(cmd)
         finally:
             os.chdir(str(cwd))
 
     def is_error_in_quickfix(self):
-        qflist = vim.eval("getqflist()")
-        for info in qflist:
-            if int(info['valid']) != 0:
-                # 有错误
-                return 1
-        return 0
+        return vimb.any_valid_quickfix()
+
+    def run_build(self, cmd):
+        if self.asyncmake and int(vimb.eval('has("timers")')):
+            self.start_build(cmd)
+        else:
+            self.async_run(cmd, self.get_make_tmpfile())
+
+    def start_build(self, cmd):
+        if self.build_job:
+            self.cancel_build()
+            self.finish_build()
+        self.build_job = AsyncJob(cmd, self.buildpath, self.get_make_tmpfile())
+        self.build_qfid = self.new_quickfix(cmd)
+        # 编译期间可能解析上次的结果，编译用单独的解析状态
+        parser = self.make_parser()
+        self.build_parser = parser and parser.copy()
+        self.build_records = []
+        # 编译输出的编码检测一次后一直使用
+        self.build_recoder = vimrecoding.StreamRecoder()
+        self.build_timer = int(vimb.eval("timer_start(200, 'VPPollBuild', {'repeat': -1})"))
+        print("Building: %s" % cmd)
+
+    def poll_build(self):
+        job = self.build_job
+        if not job:
+            self.finish_build()
+            return
+        # 每次最多处理一定行数，避免输出很多时卡住Vim
+        lines = job.take(2000)
+        if lines:
+            text = self.build_recoder.decode(b''.join(lines))
+            self.add_build_output(text.replace('\r', '').splitlines())
+        if job.finished():
+            self.finish_build()
+
+    def add_build_output(self, lines):
+        if self.build_parser:
+            self.add_build_records(self.build_parser.feed(lines))
+            return
+        # 输出中的文件名相对于BUILDPATH
+        cwd = formpath(vimb.eval('getcwd()'))
+        vimb.queue('silent cd ' + str2vimfmt(self.buildpath))
+        try:
+            vimb.call('setqflist', [], 'a', {'id': self.build_qfid, 'lines': lines})
+        finally:
+            vimb.queue('silent cd ' + str2vimfmt(cwd))
+            vimb.flush()
+
+    def add_build_records(self, records):
+        self.build_records += records
+        items = list(quickfix_items(records, self.warning, self.make_parser(False)))
+        self.add_quickfix_items(self.build_qfid, items)
+
+    def finish_build(self):
+        if self.build_timer is not None:
+            vimb.command('call timer_stop(%d)' % self.build_timer)
+            self.build_timer = None
+        job = self.build_job
+        if not job:
+            return
+        self.build_job = None
+        self.collect_build(job)
+
+    @profiled('build')
+    def collect_build(self, job):
+        job.thread.join()
+        # 编译在后台运行，记录从开始到结束的时间
+        self.profiler.record('compile', job.elapsed, subprocess=job.elapsed)
+        lines = job.take()
+        text = self.build_recoder.decode(b''.join(lines), True)
+        self.build_recoder = None
+        if text:
+            self.add_build_output(text.replace('\r', '').splitlines())
+        with self.profiler.phase('recode'):
+            vimrecoding.recode_file(self.get_make_tmpfile(), vimb.eval("&encoding"), self.encodings)
+            self.encodings.save()
+        if self.build_parser:
+            self.add_build_records(self.build_parser.flush())
+            # 已经解析过的结果留给VPLoadMakeResult和VPInvertWarning使用
+            self.make_records = self.build_records
+            self.make_key = self.make_result_key()
+            self.build_parser = None
+            self.build_records = []
+        self.open_quickfix()
+        if job.cancelled:
+            print("Build cancelled.")
+        else:
+            print("Build finished with exit code %d." % job.returncode())
+
+    def cancel_build(self):
+        if self.build_job:
+            self.build_job.cancel()
 
+    @profiled('make')
     def make_project(self, args):
         self.save_all()
         self.update_compiler_efm()
         if self.make:
-            make = self.make.replace("%:p", vim.eval('expand("%:p")'))
-            self.async_run(make + " " + args, self.get_make_tmpfile())
+            make = self.make.replace("%:p", vimb.eval('expand("%:p")'))
+            self.run_build(make + " " + args)
         else:
             print("MAKE command is not set.", file=sys.stderr)
 
+    @profiled('rebuild')
     def rebuild_project(self, args):
         self.save_all()
         self.update_compiler_efm()
         if self.rebuild:
-            make = self.rebuild.replace("%:p", vim.eval('expand("%:p")'))
-            self.async_run(make + " " + args, self.get_make_tmpfile())
+            make = self.rebuild.replace("%:p", vimb.eval('expand("%:p")'))
+            self.run_build(make + " " + args)
         else:
             print("REBUILD command is not set.", file=sys.stderr)
 
@@ -439,106 +743,505 @@ class VimProject(object):
                     fmts += _COMPILER_EFM[compiler][1]
                 fmts += _COMPILER_EFM[compiler][0]
             else:
-                vim.command("silent compiler %s" % compiler)
+                vimb.command("silent compiler %s" % compiler)
                 break
-        vim.command(r"silent set efm=%s" % ','.join(map(str2vimfmt, fmts)))
-
+        vimb.command(r"silent set efm=%s" % ','.join(map(str2vimfmt, fmts)))
+
+    def candidate_files(self, pattern):
+        if not self.index:
+            return self.files
+        needles, exact = literals(pattern, self.encoding)
+        if needles and not pattern.isascii():
+            # 同一字符串在不同编码的文件中字节不同，每种可能的编码都要查，
+            # 包括还没有检测过的文件可能被guess_encoding判断成的编码
+            encs = self.encodings.encodings()
+            encs.update(['utf-8', 'gb18030', 'big5', 'latin1'])
+            encs.discard(self.encoding)
+            for enc in encs:
+                try:
+                    needles = needles + literals(pattern, enc)[0]
+                except (UnicodeError, LookupError):
+                    pass
+        return self.trigram.candidates(self.files, needles)
+
+    @profiled('grep')
     def grep_text(self, regex):
         self.save_all()
         regex = escape_text(regex)
         if not self.files:
             self.refresh_files()
+        with self.profiler.phase('candidates') as phase:
+            files = self.candidate_files(regex)
+            phase.files = len(files)
+        # 新的搜索开始时停止上一次的后台搜索
+        self.stop_grep()
+        if self.asyncgrep and int(vimb.eval('has("timers")')):
+            self.start_grep(regex, files)
+            return
+        # 结果全部写入文件，只有第一页直接放入quickfix，其余的由VPGrepMore从文件中读取
+        items = []
+        total = 0
+        errors = []
+        with self.profiler.phase('search') as phase:
+            for match in self.search_to_file(files, regex, self.get_executor(), phase, errors=errors):
+                if not self.greplimit or total < self.greplimit:
+                    items.append(grep_item(match))
+                total += 1
+        for fname in errors:
+            print("file: %s" % fname, file=sys.stderr)
+        self.encodings.save()
+        self.show_grep_result('grep ' + regex, items, total)
+
+    def search_to_file(self, files, regex, executor, stats, stop=None, errors=None):
+        """查找并把全部结果写入搜索结果文件，可以在后台线程中运行
+
+        没有变化的文件使用上次相同搜索的结果，stats中只计入实际读取的文件。
+        """
+
+        def search(stale):
+            return find_matches(stale, regex, self.encoding, executor, self.encodings, stats, stop, errors,
+                                self.get_maxsize())
+
+        if self.grepcache:
+            matches = self.grep_cache.search(files, regex, self.encoding, search, stop, errors)
+        else:
+            matches = search(files)
         with open(self.get_grep_tmpfile(), "w", encoding="utf-8") as f:
-            for msg in find_pattern(self.files, regex, self.encoding):
-                print(msg, file=f)
-        self.load_grep_result()
-
-    def set_grep_efm(self):
-        vim.command(r"silent set efm=%f:%l:%c:%m,%f:%l:%m")
+            for match in matches:
+                print("{0}:{1}:{2}:{3}".format(*match), file=f)
+                yield match
+
+    def start_grep(self, regex, files):
+        self.grep_qfid = self.new_quickfix('grep ' + regex)
+        self.grep_shown = 0
+        self.grep_total = 0
+        self.grep_stats = Phase('search')
+        self.grep_errors = []
+        stop = threading.Event()
+        # 工作进程池在主线程中创建
+        matches = self.search_to_file(files, regex, self.get_executor(), self.grep_stats, stop, self.grep_errors)
+        self.grep_job = ThreadJob(matches, stop, name='vimproject-grep')
+        self.grep_timer = int(vimb.eval("timer_start(50, 'VPPollGrep', {'repeat': -1})"))
+        print("Grepping: %s" % regex)
+
+    def poll_grep(self):
+        job = self.grep_job
+        if not job:
+            self.finish_grep()
+            return
+        self.add_grep_matches(job.take())
+        if job.finished():
+            self.finish_grep()
+
+    def add_grep_matches(self, matches):
+        """把后台搜索新找到的结果加入quickfix，超过GREPLIMIT的只计数，由VPGrepMore加载"""
+        self.grep_total += len(matches)
+        if self.greplimit:
+            matches = matches[:max(0, self.greplimit - self.grep_shown)]
+        if not matches:
+            return
+        first = not self.grep_shown
+        self.grep_shown += len(matches)
+        self.add_quickfix_items(self.grep_qfid, [grep_item(m) for m in matches])
+        if first:
+            self.open_quickfix()
+
+    def finish_grep(self):
+        if self.grep_timer is not None:
+            vimb.command('call timer_stop(%d)' % self.grep_timer)
+            self.grep_timer = None
+        job = self.grep_job
+        if not job:
+            return
+        self.grep_job = None
+        self.collect_grep(job)
+
+    @profiled('grep')
+    def collect_grep(self, job):
+        job.thread.join()
+        stats = self.grep_stats
+        self.profiler.record('search', job.elapsed, files=stats.files, bytes=stats.bytes)
+        with self.profiler.phase('quickfix'):
+            shown = self.grep_shown
+            self.add_grep_matches(job.take())
+            self.add_grep_marker()
+            if not shown:
+                self.open_quickfix()
+        self.encodings.save()
+        for fname in self.grep_errors:
+            print("file: %s" % fname, file=sys.stderr)
+        if job.error:
+            print(job.error, file=sys.stderr)
+        if job.cancelled:
+            print("Grep cancelled, %d matches found." % self.grep_total)
+        elif self.grep_total > self.grep_shown:
+            print("%d of %d matches shown." % (self.grep_shown, self.grep_total))
+        else:
+            print("%d matches found." % self.grep_total)
 
+    def cancel_grep(self):
+        if self.grep_job:
+            self.grep_job.cancel()
+        else:
+            print("No grep is running.", file=sys.stderr)
+
+    def stop_grep(self):
+        """取消后台搜索并等待它结束，之后才能使用搜索结果文件"""
+        if self.grep_job:
+            self.grep_job.cancel()
+            self.finish_grep()
+
+    def read_grep_items(self, start, count):
+        """从搜索结果文件中读取第start行开始的count个quickfix条目，count为None时读取全部"""
+        items = []
+        with open(self.get_grep_tmpfile(), encoding="utf-8", errors="replace") as f:
+            stop = None if count is None else start + count
+            for line in islice(f, start, stop):
+                mobj = _GREP_LINE.match(line.rstrip('\n'))
+                if not mobj:
+                    items.append({'text': line.rstrip('\n'), 'valid': 0})
+                    continue
+                fname, lnum, col, text = mobj.groups()
+                items.append({'filename': os.path.join(self.basedir, fname), 'lnum': int(lnum),
+                              'col': int(col or 0), 'text': text})
+        return items
+
+    def new_quickfix(self, title):
+        """新建一个quickfix列表，返回它的id"""
+        vimb.call('setqflist', [], ' ', {'title': title})
+        return int(vimb.eval("getqflist({'id': 0}).id"))
+
+    def add_quickfix_items(self, qfid, items):
+        # 分批传给Vim，避免一次转换过多条目
+        for i in range(0, len(items), QF_BATCH):
+            vimb.call('setqflist', [], 'a', {'id': qfid, 'items': items[i:i + QF_BATCH]})
+
+    def add_grep_marker(self):
+        more = self.grep_total - self.grep_shown
+        if more > 0:
+            marker = '... %d more matches, use :VPGrepMore to load them' % more
+            self.add_quickfix_items(self.grep_qfid, [{'text': marker, 'valid': 0}])
+
+    def show_grep_result(self, title, items, total):
+        """新建quickfix列表显示搜索结果的第一页，total为结果总数"""
+        with self.profiler.phase('quickfix'):
+            self.grep_qfid = self.new_quickfix(title)
+            self.grep_shown = len(items)
+            self.grep_total = total
+            self.add_quickfix_items(self.grep_qfid, items)
+            self.add_grep_marker()
+            self.open_quickfix()
+        if total > len(items):
+            print("%d of %d matches shown." % (len(items), total))
+
+    @profiled('grep_more')
+    def grep_more(self):
+        if self.grep_job:
+            print("Grep is running.", file=sys.stderr)
+            return
+        more = self.grep_total - self.grep_shown
+        alive = self.grep_qfid and int(vimb.eval("getqflist({'id': %d}).id" % self.grep_qfid))
+        if more <= 0 or not alive:
+            print("No more matches.", file=sys.stderr)
+            return
+        # 去掉末尾的提示条目，在Vim中完成，不必把整个列表传到Python
+        vimb.eval("setqflist([], 'r', {'id': %d, 'items': getqflist({'id': %d, 'items': 0}).items[:-2]})" %
+                 (self.grep_qfid, self.grep_qfid))
+        with self.profiler.phase('read'):
+            items = self.read_grep_items(self.grep_shown, self.greplimit or None)
+        with self.profiler.phase('quickfix'):
+            self.grep_shown += len(items)
+            self.add_quickfix_items(self.grep_qfid, items)
+            self.add_grep_marker()
+        print("%d of %d matches shown." % (self.grep_shown, self.grep_total))
+
+    @profiled('replace')
     def replace_pattern(self, pattern, repl):
+        self.stop_grep()
         self.save_all()
         if not self.files:
             self.refresh_files()
-        with open(self.get_grep_tmpfile(), "w", encoding="utf-8") as f:
-            for msg in replace_pattern(self.files, pattern, repl, self.encoding):
+        with self.profiler.phase('candidates') as phase:
+            files = self.candidate_files(pattern)
+            phase.files = len(files)
+        with open(self.get_grep_tmpfile(), "w", encoding="utf-8") as f, self.profiler.phase('replace') as phase:
+            for msg in replace_pattern(files, pattern, repl, self.encoding, self.get_executor(),
+                                       self.encodings, phase):
                 print(msg, file=f)
+        self.encodings.save()
         self.load_grep_result()
 
     def load_quickfix_file(self, fname, path=None):
-        cwd = formpath(vim.eval('getcwd()'))
+        cwd = formpath(vimb.eval('getcwd()'))
         if not path:
             path = self.basedir
-        vim.command('silent cd ' + str2vimfmt(path))
-        vim.command('silent cfile %s' % str2vimfmt(fname))
-        vim.command('silent cd ' + str2vimfmt(cwd))
-        self.open_quickfix()
+        with self.profiler.phase('cfile'):
+            vimb.queue('silent cd ' + str2vimfmt(path))
+            vimb.queue('silent cfile %s' % str2vimfmt(fname))
+            vimb.queue('silent cd ' + str2vimfmt(cwd))
+            self.open_quickfix()
+
+    def make_parser(self, warning=True):
+        """COMPILER对应的解析器，有_COMPILER_EFM之外的编译器时返回None，由Vim解析
+
+        编译好的解析器按(COMPILER, BUILDPATH, 是否包括警告)缓存。
+        """
+        key = (tuple(self.compiler), self.buildpath, warning)
+        if key not in self.parsers:
+            self.parsers[key] = self._compile_parser(warning)
+        return self.parsers[key]
+
+    def _compile_parser(self, warning):
+        formats = []
+        for compiler in self.compiler or ['common']:
+            if compiler not in _COMPILER_EFM:
+                return None
+            if warning:
+                formats += [(fmt, True) for fmt in _COMPILER_EFM[compiler][1]]
+            formats += [(fmt, False) for fmt in _COMPILER_EFM[compiler][0]]
+        try:
+            return ErrorParser(formats, self.buildpath)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return None
+
+    def make_result_key(self):
+        return file_stamp(self.get_make_tmpfile()), tuple(self.compiler), self.buildpath
+
+    def parse_make_result(self):
+        """解析编译输出，包括警告，文件没有变化时使用上次的结果"""
+        key = self.make_result_key()
+        if self.make_records is None or self.make_key != key:
+            parser = self.make_parser()
+            if not parser:
+                return None
+            with open(self.get_make_tmpfile(), encoding=vimb.eval("&encoding"), errors='replace') as fp, \
+                    self.profiler.phase('parse') as phase:
+                self.make_records = parser.parse(line.rstrip('\r\n') for line in fp)
+                phase.files = 1
+                phase.bytes = os.path.getsize(self.get_make_tmpfile())
+            self.make_key = key
+        return self.make_records
+
+    def show_make_result(self, title):
+        records = self.parse_make_result()
+        if records is None:
+            self.update_compiler_efm()
+            self.load_quickfix_file(self.get_make_tmpfile(), self.buildpath)
+            return
+        with self.profiler.phase('quickfix'):
+            # 切换警告时只需重新过滤记录
+            items = list(quickfix_items(records, self.warning, self.make_parser(False)))
+            self.add_quickfix_items(self.new_quickfix(title), items)
+            self.open_quickfix()
 
+    @profiled('load_make_result')
     def load_make_result(self):
         if Path(self.get_make_tmpfile()).is_file():
-            self.update_compiler_efm()
-            self.load_quickfix_file(self.get_make_tmpfile(), self.buildpath)
+            self.show_make_result(self.get_make_tmpfile())
         else:
             print("%s not exist." % self.get_make_tmpfile(), file=sys.stderr)
 
+    @profiled('load_grep_result')
     def load_grep_result(self):
+        self.stop_grep()
         if Path(self.get_grep_tmpfile()).is_file():
-            self.set_grep_efm()
-            self.load_quickfix_file(self.get_grep_tmpfile())
+            with self.profiler.phase('read') as phase:
+                with open(self.get_grep_tmpfile(), 'rb') as f:
+                    total = sum(1 for line in f)
+                    phase.bytes = f.tell()
+                items = self.read_grep_items(0, self.greplimit or None)
+            self.show_grep_result(self.get_grep_tmpfile(), items, total)
         else:
             print("%s not exist." % self.get_grep_tmpfile(), file=sys.stderr)
 
+    @profiled('invert_warning')
     def invert_warning(self):
         self.warning = not self.warning
         self.load_make_result()
 
+    def make_filter(self):
+        # GITIGNORE为0时只使用EXCLUDE中的规则
+        return PathFilter(self.basedir, self.path, self.suffix, self.exclude,
+                          IGNORE_FILES if self.gitignore else ())
+
+    def get_maxsize(self):
+        """查找时跳过的文件大小（字节），MAXFILESIZE的单位为MB，0表示不限制，替换时不跳过"""
+        return int(self.maxfilesize * 1024 * 1024)
+
     def search_files(self):
-        basedir = Path(self.basedir)
-        for ptn in self.path:
-            for suffix in self.suffix:
-                yield from basedir.glob(ptn + "/*" + suffix)
+        return walk_files(self.make_filter())
 
     def refresh_files(self):
-        self.files = []
-        with open(self.get_file_list(), 'w') as f:
-            for fname in self.search_files():
-                self.files.append(fname)
-                print(formpath(fname), file=f)
+        files = FileSet(self.basedir)
+        with self.profiler.phase('refresh_files') as phase:
+            files.update(self.search_files())
+            phase.files = len(files)
+        self.files = files
+        with self.profiler.phase('save_files'):
+            if self.state:
+                self.state.replace_files(formpath(f) for f in files)
+            self.write_file_list(files)
+
+    def write_file_list(self, files=None):
+        # 先写临时文件再改名，避免ctags读到一半的文件列表
+        fname = self.get_file_list()
+        with atomic_write(fname) as f:
+            for path in self.files if files is None else files:
+                print(formpath(path), file=f)
+        if self.state:
+            self.state.set_meta('list_mtime', file_stamp(fname)[0])
 
     def refresh_tags(self):
-        call([
-            'ctags', '--c-kinds=+px', '--c++-kinds=+px', '--fields=+iaS', '--extras=+q', '-L',
-            self.get_file_list(), '-f',
-            self.get_tags_fname()
-        ])
-
-    def refresh_cscope(self):
+        files = [formpath(f) for f in self.files]
+        jobs = self.tagjobs or os.cpu_count() or 1
+        with self.profiler.phase('tags') as phase:
+            if self.inctags:
+                update_tags(files, self.get_tags_fname(), self.get_tagstate_fname(), jobs, self.state)
+            else:
+                build_tags(files, self.get_tags_fname(), jobs)
+            phase.files = len(files)
+        # 时间基本都花在ctags上
+        phase.subprocess = phase.seconds
+
+    def refresh_index(self):
+        if self.index:
+            with self.profiler.phase('index') as phase:
+                self.trigram.build(self.files)
+                phase.files = len(self.files)
+            if self.state:
+                self.state.mark_built('index', len(self.files))
+
+    def start_cscope(self):
+        # 生成到新文件中，完成后由swap_cscope替换，生成期间原来的数据库仍可使用
         if self.type in ['c', 'cpp', 'java']:
-            vim.command('silent! cs kill -1')
-            call([
-                'cscope', '-b', '-c', '-u', '-k', '-f',
-                self.get_cscope_fname().replace("\\", "/"), '-i',
-                self.get_file_list().replace("\\", "/")
-            ])
+            self.cscope_new = temp_fname(self.get_cscope_fname())
+            try:
+                return Popen([
+                    'cscope', '-b', '-c', '-u', '-k', '-f',
+                    self.cscope_new.replace("\\", "/"), '-i',
+                    self.get_file_list().replace("\\", "/")
+                ])
+            except OSError:
+                self.discard_cscope()
+                raise
+        return None
+
+    def swap_cscope(self):
+        new_fname, self.cscope_new = self.cscope_new, None
+        if new_fname and Path(new_fname).is_file():
+            if self.cscope_error or not os.path.getsize(new_fname):
+                os.remove(new_fname)
+                return
+            vimb.command('silent! cs kill -1')
+            os.replace(new_fname, self.get_cscope_fname())
             self.add_cscope_database()
+            vimb.flush()
+
+    def discard_cscope(self):
+        if self.cscope_new and os.path.exists(self.cscope_new):
+            os.remove(self.cscope_new)
+        self.cscope_new = None
+
+    def refresh_cscope(self):
+        proc = self.start_cscope()
+        if proc:
+            proc.wait()
+            self.swap_cscope()
+
+    def run_update(self, run=None):
+        # 可能在后台线程中运行，不能使用vim模块
+        self.profiler.attach(run)
+        try:
+            self.update_status = 'scanning files'
+            self.refresh_files()
+            self.update_status = 'building tags and cscope database'
+            start = time.perf_counter()
+            try:
+                cscope = self.start_cscope()
+            except OSError as e:
+                # 没有安装cscope时仍然生成tags
+                cscope = None
+                self.cscope_error = 'cscope: %s' % e
+            try:
+                self.refresh_tags()
+            finally:
+                if cscope:
+                    if cscope.wait():
+                        self.cscope_error = 'cscope exited with status %d' % cscope.returncode
+                    elapsed = time.perf_counter() - start
+                    self.profiler.record('cscope', elapsed, subprocess=elapsed)
+            self.update_status = 'building index'
+            self.refresh_index()
+        except Exception:
+            self.update_error = traceback.format_exc()
+        finally:
+            self.profiler.attach(None)
 
     def update(self):
+        if self.update_thread and self.update_thread.is_alive():
+            print("Update is running.", file=sys.stderr)
+            return
+        # 记录在后台线程中继续，finish_update时结束
+        self.update_run = self.profiler.start('update')
         self.save_all()
-        self.refresh_files()
-        self.refresh_tags()
-        self.refresh_cscope()
-        print("update over.")
+        self.profiler.attach(None)
+        self.update_error = None
+        self.cscope_error = None
+        if int(vimb.eval('has("timers")')):
+            self.update_thread = threading.Thread(target=self.run_update, args=(self.update_run, ),
+                                                  name='vimproject-update', daemon=True)
+            self.update_thread.start()
+            self.update_timer = int(vimb.eval("timer_start(200, 'VPPollUpdate', {'repeat': -1})"))
+        else:
+            self.run_update(self.update_run)
+            self.finish_update()
+
+    def wait_update(self):
+        """等待正在后台运行的更新结束"""
+        if self.update_thread:
+            self.update_thread.join()
+            self.poll_update()
+
+    def poll_update(self):
+        if self.update_thread and self.update_thread.is_alive():
+            if self.update_status != self.update_shown:
+                self.update_shown = self.update_status
+                vimb.command("redraw | echo 'VPUpdateTags: %s...'" % self.update_status)
+            return
+        if self.update_timer is not None:
+            vimb.command('call timer_stop(%d)' % self.update_timer)
+            self.update_timer = None
+        self.update_thread = None
+        self.finish_update()
+
+    def finish_update(self):
+        run, self.update_run = self.update_run, None
+        self.profiler.attach(run)
+        try:
+            if self.cscope_error:
+                print(self.cscope_error, file=sys.stderr)
+            if self.update_error:
+                print(self.update_error, file=sys.stderr)
+                self.discard_cscope()
+                return
+            with self.profiler.phase('swap_cscope'):
+                self.swap_cscope()
+            print("update over.")
+        finally:
+            if run:
+                self.profiler.finish(run)
 
     def run_execute(self, args):
         if self.execute:
             execute = self.execute  #.replace('/', '\\')
-            origdir = formpath(vim.eval('getcwd()'))
-            vim.command('silent! lcd ' + str2vimfmt(self.execpath))
+            origdir = formpath(vimb.eval('getcwd()'))
+            vimb.command('silent! lcd ' + str2vimfmt(self.execpath))
             os.system(execute + ' ' + args + (' && pause || pause' if self.pause else ''))
-            vim.command('silent! lcd ' + str2vimfmt(origdir))
+            vimb.command('silent! lcd ' + str2vimfmt(origdir))
         else:
-            if vim.eval('&ft') in ['python', 'perl', 'lua']:
-                os.system(vim.eval('&ft') + ' ' + vim.eval('''expand('%:p')''') + ' ' + args + ' && pause || pause')
+            if vimb.eval('&ft') in ['python', 'perl', 'lua']:
+                os.system(vimb.eval('&ft') + ' ' + vimb.eval('''expand('%:p')''') + ' ' + args + ' && pause || pause')
             else:
                 print("no execute", file=sys.stderr)
 
@@ -551,7 +1254,7 @@ except Exception as e:
 
 
 def from_this_file():
-    fname = vim.eval('''expand('%:p')''')
+    fname = vimb.eval('''expand('%:p')''')
     g_vimproject.from_file(fname)
 
 
@@ -562,7 +1265,7 @@ def update_project_history():
     fname = str(g_vimproject.projectfile)
     if fname.endswith(".vprj"):
         fs = []
-        histfile = vim.eval("$HOME") + "/.vimproject"
+        histfile = vimb.eval("$HOME") + "/.vimproject"
         if Path(histfile).is_file():
             fs = [l for l in [l.strip() for l in open(histfile, "r").readlines()] if l]
         try:
@@ -584,16 +1287,16 @@ def update_project_history():
 
 
 def select_history_project():
-    histfile = vim.eval("$HOME") + "/.vimproject"
+    histfile = vimb.eval("$HOME") + "/.vimproject"
     if Path(histfile).is_file():
         fs = [Path(line.strip()) for line in open(histfile).readlines() if line.strip()]
         if fs:
             ret = int(
-                vim.eval('''inputlist(['Project history list here, select one:', %s])''' %
+                vimb.eval('''inputlist(['Project history list here, select one:', %s])''' %
                          ', '.join('"%2d: %s"' % (i, formpath(f)) for i, f in enumerate(fs, 1))))
             if 0 < ret <= len(fs):
                 if fs[ret - 1].exists():
-                    vim.command('silent edit %s' % str2vimfmt(formpath(fs[ret - 1])))
+                    vimb.command('silent edit %s' % str2vimfmt(formpath(fs[ret - 1])))
                 else:
                     print("Cannot find file: %s" % str(fs[ret - 1]), file=sys.stderr)
         else:
@@ -605,15 +1308,18 @@ def select_history_project():
 def edit_project_file():
     if g_vimproject.projectfile:
         cmd = 'silent edit %s' % str2vimfmt(formpath(g_vimproject.projectfile))
-        vim.command(cmd)
+        vimb.command(cmd)
         return
     print("Project file does not exist, cannot open it!", file=sys.stderr)
 
 
 def edit_file_list_file():
     fname = g_vimproject.get_file_list()
+    if g_vimproject.state and g_vimproject.files:
+        # 监视线程的修改只记录在数据库中
+        g_vimproject.write_file_list()
     if Path(fname).is_file():
-        vim.command('silent edit %s' % str2vimfmt(fname))
+        vimb.command('silent edit %s' % str2vimfmt(fname))
     else:
         print("File list file does not exist, cannot open it!", file=sys.stderr)
 
@@ -634,7 +1340,7 @@ def start_terminal_on_project():
                 shell=1)
 
     else:
-        vim.command(":term")
+        vimb.command(":term")
 
 
 def to_re_pattern(s):
@@ -644,73 +1350,61 @@ def to_re_pattern(s):
             ss.append("\\")
             ss.append(c)
         elif c == "\n":
-            ss.append('\\n')
+            # 整个文件一起搜索，选中多行时也要匹配DOS格式的换行
+            ss.append('\\r?\\n')
         else:
             ss.append(c)
     return ''.join(ss)
 
 
 def grep_selection():
-    selection = vim.eval("VPGetVisual()")
+    selection = vimb.eval("VPGetVisual()")
     if not selection:
         return
     g_vimproject.grep_text(to_re_pattern(selection))
 
 
 def replace_to(pattern):
-    ret = vim.eval('input("Input replacement: ")')
-    do = vim.eval('''input('Do you want to replace "%s" to "%s"?(y/n)')''' % (pattern, ret))
+    ret = vimb.eval('input("Input replacement: ")')
+    do = vimb.eval('''input('Do you want to replace "%s" to "%s"?(y/n)')''' % (pattern, ret))
     if do and do.lower() in ['y', 'yes']:
         g_vimproject.replace_pattern(pattern, ret)
 
 
 def replace_input():
-    pattern = vim.eval('input("Input pattern: ")')
+    pattern = vimb.eval('input("Input pattern: ")')
     if not pattern:
         return
     replace_to(pattern)
 
 
 def replace_this_word():
-    word = vim.eval('expand("<cword>")')
+    word = vimb.eval('expand("<cword>")')
     if not word:
         return
     replace_to("".join(["\\b", word, "\\b"]))
 
 
 def replace_selection():
-    sel = vim.eval('VPGetVisual()')
+    sel = vimb.eval('VPGetVisual()')
     replace_to(to_re_pattern(sel))
 
 
-def detect_project():
-    if g_vimproject.projectname:  # already editor a project file
+def show_profile(fname=''):
+    """显示最近几次命令各阶段的耗时和Vim调用统计，指定fname时保存为json"""
+    if fname:
+        with open(fname, 'w', encoding='utf-8') as fp:
+            json.dump({'runs': g_vimproject.profiler.to_list(), 'vim_calls': vimb.stats}, fp, indent=2)
+        print("profile saved to %s" % fname)
         return
+    print(g_vimproject.profiler.report() or "no command profiled.")
+    print(vimb.report())
 
-    cwd = Path.cwd()
-
-    # find any .vprj file in current dir or parent dir
-    while 1:
-        prj = cwd / ".vprj"
-        if prj.exists():
-            g_vimproject.from_file(prj)
-            return
-
-        parent = cwd.parent
-        if parent == cwd:
-            break
-        else:
-            cwd = parent
 
-    # if not .vprj found, find any file endswith .vprj
-    cwd = Path.cwd()
-    while 1:
-        for f in cwd.glob('*.vprj'):
-            g_vimproject.from_file(f)
-            return
+def detect_project(prj):
+    """prj为vimproject.vim中s:FindProject找到的项目文件"""
+    if g_vimproject.projectname:  # already editor a project file
+        return
 
-        parent = cwd.parent
-        if parent == cwd:
-            break
-        else:
-            cwd = parent
+    if prj:
+        g_vimproject.from_file(prj)
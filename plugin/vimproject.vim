@@ -1,5 +1,5 @@
 "coding:utf-8
-if has('g:vimproject_loaded')
+if exists('g:vimproject_loaded') || !has('python3')
     finish
 endif
 let g:vimproject_loaded = 1
@@ -19,33 +19,119 @@ function! VPGetVisual() range
     return selection
 endfunction
 
-python3 << PYTHON_EOF
+function! VPPollBuild(timer)
+    call s:Python('g_vimproject.poll_build()')
+endfunction
+
+function! VPPollUpdate(timer)
+    call s:Python('g_vimproject.poll_update()')
+endfunction
+
+function! VPPollGrep(timer)
+    call s:Python('g_vimproject.poll_grep()')
+endfunction
+
+" Python模块和项目对象在第一次使用或者找到项目文件时才加载，
+" 加载耗时保存在g:vimproject_load_time中（秒）
+let s:path_added = 0
+let s:loaded = 0
+
+function! s:AddPath()
+    if s:path_added
+        return
+    endif
+    let s:path_added = 1
+    python3 << PYTHON_EOF
 import sys
 import vim
 sys.path.append(vim.eval("s:plugin_path"))
-from vimproject import *
 PYTHON_EOF
+endfunction
+
+function! s:Load()
+    if s:loaded
+        return
+    endif
+    let s:loaded = 1
+    let start = reltime()
+    call s:AddPath()
+    python3 from vimproject import *
+    let g:vimproject_load_time = reltimefloat(reltime(start))
+endfunction
+
+function! s:Python(cmd)
+    call s:Load()
+    execute 'python3 ' . a:cmd
+endfunction
+
+" 目录中以.vprj结尾的文件名，包括.vprj和.foo.vprj
+function! s:ProjectNames(dir)
+    if exists('*readdir')
+        return sort(readdir(a:dir, {n -> n =~# '\.vprj$'}))
+    endif
+    " 没有readdir()时用globpath，目录名中的通配符需要转义，*不匹配开头的.
+    let dir = escape(a:dir, ',*?[{\')
+    let names = globpath(dir, '.vprj', 1, 1) + globpath(dir, '*.vprj', 1, 1) + globpath(dir, '.*.vprj', 1, 1)
+    return sort(map(names, 'fnamemodify(v:val, ":t")'))
+endfunction
+
+" 从当前目录向上查找项目文件：任何上级目录中的.vprj都优先于*.vprj，
+" 否则使用最近的目录中名字最小的*.vprj。只在Vim脚本中查找，没有项目时不初始化Python
+function! s:FindProject()
+    let named = ''
+    let dir = getcwd()
+    while 1
+        let prefix = dir =~ '[/\\]$' ? dir : dir . '/'
+        let names = s:ProjectNames(dir)
+        if index(names, '.vprj') >= 0
+            return prefix . '.vprj'
+        endif
+        if named == '' && !empty(names)
+            let named = prefix . names[0]
+        endif
+        let parent = fnamemodify(dir, ':h')
+        if parent == dir
+            return named
+        endif
+        let dir = parent
+    endwhile
+endfunction
 
-au FileType vimproj             python3 from_this_file()
-au FileType vimproj             python3 update_project_history()
+function! s:DetectProject()
+    let s:detected = s:FindProject()
+    if s:detected != ''
+        call s:Python('detect_project(vim.eval("s:detected"))')
+    endif
+endfunction
+
+function! s:Close()
+    if s:loaded
+        python3 g_vimproject.close()
+    endif
+endfunction
+
+au FileType vimproj             call s:Python('from_this_file()')
+au FileType vimproj             call s:Python('update_project_history()')
 au FileType vimproj             set syntax=python
-au BufWritePost *.vprj,*.jvprj  python3 from_this_file()
-au VimEnter *                   python3 detect_project()
-
-au VimLeavePre *                python3 g_vimproject.write_session_file()
-
-command! -nargs=* VPRunExecution    python3 g_vimproject.run_execute('''<args>''')
-command! -nargs=* VPMakeProject     python3 g_vimproject.make_project('''<args>''')
-command! -nargs=* VPRebuildProject  python3 g_vimproject.rebuild_project('''<args>''')
-command! VPUpdateTags               python3 g_vimproject.update()
-command! VPInvertWarning            python3 g_vimproject.invert_warning()
-command! VPEditProject              python3 edit_project_file()
-command! VPEditFileListFile         python3 edit_file_list_file()
-command! VPSelectHistProject        python3 select_history_project()
-command! VPLoadMakeResult           python3 g_vimproject.load_make_result()
-command! VPLoadGrepResult           python3 g_vimproject.load_grep_result()
-command! VPStartTerminal            python3 start_terminal_on_project()
-command! VPLoadSessionFile          python3 g_vimproject.load_session_file()
+au BufWritePost *.vprj,*.jvprj  call s:Python('from_this_file()')
+au VimEnter *                   call s:DetectProject()
+
+au VimLeavePre *                call s:Close()
+
+command! -nargs=* VPRunExecution    call s:Python("g_vimproject.run_execute('''" . <q-args> . "''')")
+command! -nargs=* VPMakeProject     call s:Python("g_vimproject.make_project('''" . <q-args> . "''')")
+command! -nargs=* VPRebuildProject  call s:Python("g_vimproject.rebuild_project('''" . <q-args> . "''')")
+command! VPCancelMake               call s:Python('g_vimproject.cancel_build()')
+command! VPUpdateTags               call s:Python('g_vimproject.update()')
+command! VPInvertWarning            call s:Python('g_vimproject.invert_warning()')
+command! VPEditProject              call s:Python('edit_project_file()')
+command! VPEditFileListFile         call s:Python('edit_file_list_file()')
+command! VPSelectHistProject        call s:Python('select_history_project()')
+command! VPLoadMakeResult           call s:Python('g_vimproject.load_make_result()')
+command! VPLoadGrepResult           call s:Python('g_vimproject.load_grep_result()')
+command! VPStartTerminal            call s:Python('start_terminal_on_project()')
+command! VPLoadSessionFile          call s:Python('g_vimproject.load_session_file()')
+command! -nargs=? -complete=file VPProfile call s:Python("show_profile('''" . <q-args> . "''')")
 
 "greps
 function! s:GrepThisWord()
@@ -54,7 +140,7 @@ function! s:GrepThisWord()
         if &encoding != &termencoding
             let word = iconv(word, &encoding, &termencoding)
         endif
-        execute 'python3 g_vimproject.grep_text("\\b' . expand('<cword>') . '\\b")'
+        call s:Python('g_vimproject.grep_text("\\b' . expand('<cword>') . '\\b")')
     endif
 endfunction
 
@@ -64,13 +150,15 @@ function! s:GrepPattern()
         if &encoding != &termencoding
             " let pattern = iconv(pattern, &encoding, &termencoding)
         endif
-        execute 'python3 g_vimproject.grep_text("' . pattern . '")'
+        call s:Python('g_vimproject.grep_text("' . pattern . '")')
     endif
 endfunction
 
 command! VPGrepThisWord         call s:GrepThisWord()
 command! VPGrepInput            call s:GrepPattern()
-command! VPGrepSelection        python3 grep_selection()
-command! VPReplaceThisWord      python3 replace_this_word()
-command! VPReplaceInput         python3 replace_input()
-command! VPReplaceSelection     python3 replace_selection()
+command! VPGrepMore             call s:Python('g_vimproject.grep_more()')
+command! VPGrepCancel           call s:Python('g_vimproject.cancel_grep()')
+command! VPGrepSelection        call s:Python('grep_selection()')
+command! VPReplaceThisWord      call s:Python('replace_this_word()')
+command! VPReplaceInput         call s:Python('replace_input()')
+command! VPReplaceSelection     call s:Python('replace_selection()')
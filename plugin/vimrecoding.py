@@ -1,13 +1,23 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*-
 
-import os
 import sys
+import codecs
+import argparse
+import threading
 try:
     import chardet
 except ImportError:
     chardet = None
 
+from fileutil import atomic_write
+
+
+# 转换时每次读取的字节数
+CHUNK_SIZE = 1024 * 1024
+# 转换标准输入时，输出在缓冲区中最多停留的秒数
+FLUSH_INTERVAL = 0.2
+
 
 def guess_encoding(line):
     encs = ["ascii", "utf-8", "gb18030", "big5", "latin1"]
@@ -27,20 +37,142 @@ def guess_encoding(line):
         return "", line.decode("utf-8", 'ignore')
 
 
-def recode_std(enc):
-    while 1:
-        line = sys.stdin.readline()
-        if not line:
-            break
-        src_enc, new_line = guess_encoding(line)
+class StreamRecoder(object):
+    """转换编码不确定的字节流，如编译器的输出
+
+    根据第一块数据检测出的编码一直使用下去，某一块用它解码失败时才逐行重新检测，
+    并改用新检测出的编码。数据可以在任意位置分块。
+    """
+
+    def __init__(self, enc='utf-8', src_enc=None):
+        self.encoder = codecs.getincrementalencoder(enc)("replace")
+        self.src_enc = None
+        self.decoder = None
+        if src_enc:
+            self._use(src_enc)
+
+    def _use(self, src_enc):
+        self.src_enc = src_enc
+        self.decoder = codecs.getincrementaldecoder(src_enc)()
+
+    def decode(self, data, final=False):
+        if self.decoder is None:
+            if not data and not final:
+                return ''
+            src_enc = guess_sample_encoding(data, final)
+            # latin1能解码任何数据，用它的话以后就不会再检测
+            self._use("utf-8" if src_enc == "latin1" else src_enc)
+        buffered = self.decoder.getstate()[0]
+        try:
+            return self.decoder.decode(data, final)
+        except UnicodeDecodeError:
+            return self._redetect(buffered + data, final)
+
+    def _redetect(self, data, final):
+        cut = len(data) if final else data.rfind(b'\n') + 1
+        text = []
+        for line in data[:cut].splitlines(True):
+            try:
+                text.append(line.decode(self.src_enc))
+            except UnicodeDecodeError:
+                src_enc, new_line = guess_encoding(line)
+                text.append(new_line)
+                if src_enc not in ("ascii", "latin1", ""):
+                    self.src_enc = src_enc
+        # 最后不完整的一行交给新的解码器
+        self._use(self.src_enc)
+        try:
+            text.append(self.decoder.decode(data[cut:], final))
+        except UnicodeDecodeError:
+            self._use(self.src_enc)
+            text.append(data[cut:].decode(self.src_enc, "replace"))
+        return ''.join(text)
+
+    def recode(self, data, final=False):
+        return self.encoder.encode(self.decode(data, final), final)
+
+
+def recode_std(enc, src_enc=None, src=None, dst=None, interval=FLUSH_INTERVAL):
+    """把标准输入转换为enc编码写到标准输出
+
+    输入有多少读多少，最多CHUNK_SIZE字节。输出不是每次都写出，由另一个线程每隔interval秒写出一次。
+    """
+    src = src or sys.stdin.buffer
+    dst = dst or sys.stdout.buffer
+    read = getattr(src, 'read1', src.read)
+    recoder = StreamRecoder(enc, src_enc)
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def flush():
+        while not done.wait(interval):
+            with lock:
+                dst.flush()
+
+    thread = threading.Thread(target=flush, name='recode-flush', daemon=True)
+    thread.start()
+    try:
+        while 1:
+            chunk = read(CHUNK_SIZE)
+            data = recoder.recode(chunk, not chunk)
+            with lock:
+                dst.write(data)
+            if not chunk:
+                break
+    finally:
+        done.set()
+        thread.join()
+        dst.flush()
+
+
+def guess_sample_encoding(sample, complete=False):
+    """根据文件开头的一部分内容猜测整个文件的编码"""
+    if not complete:
+        # 去掉最后不完整的一行，避免截断多字节字符
+        cut = sample.rfind(b'\n')
+        if cut > 0:
+            sample = sample[:cut + 1]
+    try:
+        enc = guess_encoding(sample)[0]
+        codecs.lookup(enc)
+    except (LookupError, TypeError):
+        return "utf-8"
+    # 开头是ascii不代表后面也是，utf-8兼容ascii
+    if enc == "ascii":
+        return "utf-8"
+    return enc
+
+
+def recode_file(fname, enc, encodings=None):
+    """把fname转换为enc编码，encodings为EncodingCache时优先使用其中记录的编码
+
+    与StreamRecoder一样，某一块用当前编码解码失败时逐行重新检测，不会把后面不同编码的内容替换成乱码。
+    返回最后使用的源编码。
+    """
+    recoder = StreamRecoder(enc, encodings.get(fname) if encodings else None)
+    # 写到临时文件中，完成后再改名，中途出错不会破坏原文件。原文件先关闭，Windows上才能覆盖
+    with atomic_write(fname, "wb", keep_mode=True) as dst, open(fname, "rb") as src:
+        while 1:
+            chunk = src.read(CHUNK_SIZE)
+            dst.write(recoder.recode(chunk.replace(b'\r', b''), not chunk))
+            if not chunk:
+                break
+    if encodings:
+        encodings.set(fname, enc)
+    return recoder.src_enc
 
-        sys.stdout.write(new_line.encode(enc, "replace"))
-        sys.stdout.flush()
 
+def main():
+    parser = argparse.ArgumentParser(description="convert text in any encoding to ENC")
+    parser.add_argument("enc")
+    parser.add_argument("files", nargs="*", help="convert these files in place instead of stdin to stdout")
+    parser.add_argument("--from", dest="src_enc", help="encoding of stdin, detected if not given")
+    args = parser.parse_args()
+    if not args.files:
+        recode_std(args.enc, args.src_enc)
+    for fname in args.files:
+        recode_file(fname, args.enc)
 
-def recode_file(fname, enc):
-    text = open(fname, "rb").read().replace(b'\r', b'')
-    src_enc, new_text = guess_encoding(text)
 
-    with open(fname, "wb") as f:
-        f.write(new_text.encode(enc, "replace"))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+# -*- coding:utf-8 -*-
+# 测试不需要Vim：插件目录加入sys.path，vim模块由bench/fakevim.py代替
+
+import os
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(_ROOT, 'plugin'), os.path.join(_ROOT, 'bench')]
+
+import fakevim  # noqa: E402
+
+fakevim.install()
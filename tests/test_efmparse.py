@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+# 期望的结果与Vim用同样的errorformat执行cgetexpr得到的quickfix条目一致
+
+import pytest
+
+from efmparse import ErrorParser, compile_format, quickfix_items
+from vimproject import _COMPILER_EFM
+
+
+def _parser(compiler, warning=True, basedir='/b'):
+    errors, warnings = _COMPILER_EFM[compiler]
+    formats = ([(fmt, True) for fmt in warnings] if warning else []) + [(fmt, False) for fmt in errors]
+    return ErrorParser(formats, basedir)
+
+
+GCC_OUTPUT = [
+    'src/a.c:12:5: error: expected ;',
+    'src/a.c:3:1: warning: unused x',
+    "main.c:7: undefined reference to `g'",
+    'make: *** [all] Error 1',
+]
+
+
+def test_compiler_formats_compile():
+    for compiler, (errors, warnings) in _COMPILER_EFM.items():
+        for fmt in errors + warnings:
+            compile_format(fmt)
+
+
+def test_gcc():
+    records = _parser('gcc').parse(GCC_OUTPUT)
+    assert [r[0] for r in records] == ['e', 'w', 'e', None]
+    assert records[0][2] == {'text': ' expected ;', 'valid': 1, 'filename': '/b/src/a.c', 'lnum': 12, 'col': 5,
+                             'type': 'e'}
+    assert records[1][1] == ['src/a.c:3:1: warning: unused x']
+    assert records[2][2] == {'text': "undefined reference to `g'", 'valid': 1, 'filename': '/b/main.c', 'lnum': 7}
+    assert records[3][2] == {'text': 'make: *** [all] Error 1', 'valid': 0}
+
+
+def test_warning_off():
+    records = _parser('gcc').parse(GCC_OUTPUT)
+    items = list(quickfix_items(records, False, _parser('gcc', False)))
+    assert items[1] == {'text': 'src/a.c:3:1: warning: unused x', 'valid': 0}
+    assert [it['valid'] for it in items] == [1, 0, 1, 0]
+
+
+def test_multiline_javac():
+    lines = ['A.java:3: error: cannot find symbol', '        foo();', '        ^', 'done']
+    records = _parser('javac').parse(lines)
+    assert [r[2] for r in records] == [
+        {'text': 'cannot find symbol', 'valid': 1, 'type': 'E', 'filename': '/b/A.java', 'lnum': 3, 'col': 9, 'vcol': 1},
+        {'text': 'done', 'valid': 0},
+    ]
+
+
+def test_feed_in_pieces():
+    lines = ['A.java:3: error: cannot find symbol', '        foo();', '        ^', 'done']
+    parser = _parser('javac')
+    # 多行记录结束之前不返回
+    assert parser.feed(lines[:2]) == []
+    records = parser.feed(lines[2:]) + parser.flush()
+    assert records == _parser('javac').parse(lines)
+
+
+def test_copy_is_independent():
+    parser = _parser('javac')
+    copy = parser.copy()
+    parser.feed(['A.java:3: error: cannot find symbol'])
+    assert copy.flush() == []
+    assert len(parser.flush()) == 1
+
+
+@pytest.mark.parametrize('fmt', ['%Xfoo', '%f:%f', '%q'])
+def test_unsupported_format(fmt):
+    with pytest.raises(ValueError):
+        compile_format(fmt)
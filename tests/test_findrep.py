@@ -0,0 +1,86 @@
+# -*- coding:utf-8 -*-
+
+import random
+import re
+
+import pytest
+
+from findrep import _search_buffer, literals
+
+BUFFERS = [
+    b'',
+    b'a b\nc\n',
+    b'foo_bar = foo\nbar\n  foo_bar(1)\n',
+    b'ABC abc \\x41BC\nx.y xay\n',
+    b'line1\nline2\n\nline3',
+    b'count counter recount\ncount\n',
+    b'ab\nab\nab\nab\nab\nab\nab\nab\nab\nab\nab\n',
+]
+
+PATTERNS = [
+    'foo_bar', 'foo|bar', r'\bcount\b', 'count', r'\x41BC', r'\101BC', 'x.y', r'x\.y',
+    'a b\nc', r'a b\nc', 'a|b\nc', r'b\nc', '^line', 'line3$', r'\Aline1', r'line3\Z',
+    'ab*c', 'ab?', 'a{2}', r'\d+', r'(foo)_bar', '[ab]c', r'(a)\1', r'\N{LATIN SMALL LETTER A}b',
+    r'\u0061b', 'ab', 'b\na',
+]
+
+
+def _positions(buf, ptn):
+    return [(buf.count(b'\n', 0, m.start()) + 1, m.start() - (buf.rfind(b'\n', 0, m.start()) + 1) + 1)
+            for m in ptn.finditer(buf)]
+
+
+def _search(buf, pattern, needles, exact):
+    msgs = []
+    _search_buffer(buf, 'f', re.compile(pattern.encode('utf-8'), re.MULTILINE), 'utf-8', msgs, needles, exact)
+    return [(lineno, col) for fname, lineno, col, text in msgs]
+
+
+def _check(buf, pattern):
+    try:
+        ptn = re.compile(pattern.encode('utf-8'), re.MULTILINE)
+    except re.error:
+        return
+    expected = _positions(buf, ptn)
+    needles, exact = literals(pattern, 'utf-8')
+    if needles is not None and expected:
+        # 能匹配的内容中一定有某个字符串
+        assert any(n in buf for n in needles), (pattern, buf, needles)
+    assert _search(buf, pattern, needles, exact) == expected, (pattern, buf, needles, exact)
+
+
+@pytest.mark.parametrize('pattern', PATTERNS)
+def test_search_buffer_matches_finditer(pattern):
+    for buf in BUFFERS:
+        _check(buf, pattern)
+
+
+def test_literals():
+    assert literals('foo_bar', 'utf-8') == ([b'foo_bar'], True)
+    assert literals('foo|bar', 'utf-8') == ([b'foo', b'bar'], True)
+    assert literals(r'\bcount\b', 'utf-8') == ([b'count'], True)
+    assert literals('ab*c', 'utf-8') == ([b'a'], False)
+    assert literals(r'x\.y', 'utf-8') == ([b'x.y'], True)
+    assert literals('x.y', 'utf-8')[1] is False
+    assert literals('(foo)', 'utf-8') == (None, False)
+    assert literals(r'\x41BC', 'utf-8') == (None, False)
+    assert literals(r'\101BC', 'utf-8') == (None, False)
+    # 跨行的字符串不能只在包含它的行上匹配
+    assert literals('a|b\nc', 'utf-8')[1] is False
+    assert literals('中文', 'gbk') == (['中文'.encode('gbk')], True)
+
+
+def test_region_search_with_many_hits():
+    buf = b''.join(b'%d foo\n' % i for i in range(100))
+    assert _search(buf, 'foo', [b'foo'], True) == [(i + 1, len(b'%d ' % i) + 1) for i in range(100)]
+
+
+def test_random_patterns():
+    tokens = ['a', 'b', 'c', ' ', '\n', r'\n', '.', '*', '?', '+', '{2}', '|', '^', '$', r'\b', r'\d', r'\.', r'\A', r'\Z',
+              r'\x61', r'\s', 'ab', 'b\n']
+    rnd = random.Random(0)
+    bufs = [bytes(rnd.choice(b'abc \n.1') for _ in range(rnd.randint(0, 40))) for _ in range(30)]
+    for _ in range(2000):
+        pattern = ''.join(rnd.choice(tokens) for _ in range(rnd.randint(1, 6)))
+        for buf in bufs:
+            _check(buf, pattern)
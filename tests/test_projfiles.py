@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*-
+
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from projfiles import FileSet, PathFilter, walk_files
+
+GITIGNORE = '''
+# 注释
+*.o
+build/
+/top.c
+docs/*.c
+!keep.o
+**/gen/*.c
+tmp?
+[ab]x.c
+sub/**/deep.c
+dir_only/
+\\#hash.c
+re.c
+'''
+
+FILES = [
+    'a.c', 'a.o', 'keep.o', 'top.c', 'src/top.c', 'build/b.c', 'src/build/c.c', 'docs/d.c', 'docs/x/d.c',
+    'gen/g.c', 'src/gen/g.c', 'src/gen/x/g.c', 'tmp1/t.c', 'tmp12/t.c', 'ax.c', 'cx.c', 'sub/deep.c',
+    'sub/1/2/deep.c', 'dir_only/f.c', 'src/dir_only', '#hash.c', 'src/.gitignore', 'src/local.c', 'src/n/local.c',
+    'src/re.c', '.git2/x.c',
+]
+
+SUB_GITIGNORE = '''
+local.c
+!/re.c
+'''
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for name in FILES:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('')
+    (tmp_path / '.gitignore').write_text(GITIGNORE)
+    (tmp_path / 'src' / '.gitignore').write_text(SUB_GITIGNORE)
+    return tmp_path
+
+
+def _git(root, *args):
+    env = dict(os.environ, HOME=str(root), GIT_CONFIG_NOSYSTEM='1')
+    return subprocess.run(['git'] + list(args), cwd=str(root), env=env, check=True, stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout
+
+
+@pytest.mark.skipif(shutil.which('git') is None, reason='git is not installed')
+def test_ignore_rules_match_git(tree):
+    _git(tree, 'init', '-q')
+    expected = sorted(str(tree / p) for p in _git(tree, 'ls-files', '--others', '--exclude-standard').split()
+                      if p.endswith('.c'))
+    filt = PathFilter(str(tree), ['**'], ['.c'])
+    assert sorted(walk_files(filt)) == expected
+    for path in expected:
+        assert filt.match_file(path)
+
+
+def test_exclude_and_gitignore_switch(tree):
+    files = set(walk_files(PathFilter(str(tree), ['**'], ['.c'], exclude=['src/'], ignore_files=())))
+    assert str(tree / 'build' / 'b.c') in files
+    assert not any(p.startswith(str(tree / 'src')) for p in files)
+
+
+def test_walk_files_matches_glob(tree):
+    (tree / 'lnk').symlink_to('src')
+    for path in (['.'], ['src'], ['src/**'], ['*'], ['lnk'], ['**']):
+        expected = sorted(set(str(p) for ptn in path for p in tree.glob(ptn + '/*.c')))
+        assert sorted(walk_files(PathFilter(str(tree), path, ['.c'], ignore_files=()))) == expected, path
+
+
+def test_file_set(tmp_path):
+    base = str(tmp_path)
+    files = FileSet(base, [os.path.join(base, 'a.c'), os.path.join(base, 'x', '..', 'a.c'), '/outside/b.c'])
+    assert len(files) == 2
+    assert list(files) == [os.path.join(base, 'a.c'), '/outside/b.c']
+    assert os.path.join(base, 'a.c') in files
+    assert Path(base, 'a.c') in files
+
+    copy = files.copy()
+    copy.update([os.path.join(base, 'd', 'c.c'), os.path.join(base, 'd', 'e', 'f.c'), os.path.join(base, 'dd.c')])
+    assert len(files) == 2
+    copy.discard_trees([os.path.join(base, 'd')])
+    assert sorted(copy) == sorted([os.path.join(base, 'a.c'), os.path.join(base, 'dd.c'), '/outside/b.c'])
+    copy.discard(os.path.join(base, 'a.c'))
+    copy.discard(os.path.join(base, 'missing.c'))
+    assert os.path.join(base, 'a.c') not in copy
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+import tagbuild
+from statedb import open_state
+from tagbuild import update_tags
+
+# 代替ctags：每个文件的每一行"名字"生成一个tag
+FAKE_CTAGS = '''#!%s
+import sys
+args = sys.argv[1:]
+lines = []
+with open(args[args.index('-L') + 1]) as fp:
+    for path in fp.read().split():
+        with open(path) as src:
+            for name in src.read().split():
+                lines.append('%%s\\t%%s\\t1;"\\tv\\n' %% (name, path))
+with open(args[args.index('-f') + 1], 'w') as fp:
+    fp.write('!_TAG_FILE_SORTED\\t1\\t//\\n')
+    fp.writelines(sorted(lines))
+''' % sys.executable
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='fake ctags is a shell script')
+
+
+@pytest.fixture
+def ctags(tmp_path, monkeypatch):
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    script = bindir / 'ctags'
+    script.write_text(FAKE_CTAGS)
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ['PATH'])
+    calls = []
+    popen = tagbuild.Popen
+
+    def record(args, *a, **kw):
+        with open(args[args.index('-L') + 1]) as fp:
+            calls.append(fp.read().split())
+        return popen(args, *a, **kw)
+
+    monkeypatch.setattr(tagbuild, 'Popen', record)
+    return calls
+
+
+def _write(path, text):
+    path.write_text(text)
+    # 保证修改时间与上次不同
+    st = os.stat(str(path))
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+
+def _tags(fname):
+    with open(fname) as fp:
+        return [line.split('\t')[:2] for line in fp if not line.startswith('!_')]
+
+
+@pytest.mark.parametrize('use_store', [False, True])
+def test_update_tags(tmp_path, ctags, use_store):
+    store = open_state(str(tmp_path / 'state.db')) if use_store else None
+    src = tmp_path / 'src'
+    src.mkdir()
+    files = []
+    for name, text in (('a.c', 'alpha'), ('b.c', 'beta'), ('c.c', 'gamma delta')):
+        (src / name).write_text(text)
+        files.append(str(src / name))
+    tags = str(tmp_path / 'tags')
+    state = str(tmp_path / 'tagstate')
+
+    assert update_tags(files, tags, state, store=store) == 0
+    assert ctags == [files]
+    assert _tags(tags) == [['alpha', files[0]], ['beta', files[1]], ['delta', files[2]], ['gamma', files[2]]]
+
+    # 没有变化时不运行ctags
+    assert update_tags(files, tags, state, store=store) == 0
+    assert len(ctags) == 1
+
+    # 全量生成时不记录md5，第一次修改后才记录，之后只touch过的文件不重新生成
+    _write(src / 'a.c', 'alpha')
+    assert update_tags(files, tags, state, store=store) == 0
+    assert ctags[-1] == [files[0]]
+    _write(src / 'a.c', 'alpha')
+    assert update_tags(files, tags, state, store=store) == 0
+    assert len(ctags) == 2
+    assert _tags(tags) == [['alpha', files[0]], ['beta', files[1]], ['delta', files[2]], ['gamma', files[2]]]
+
+    # 修改的文件重新生成，删除的文件去掉，新增的文件加入
+    _write(src / 'b.c', 'bravo')
+    os.remove(files[2])
+    (src / 'd.c').write_text('echo')
+    files = files[:2] + [str(src / 'd.c')]
+    assert update_tags(files, tags, state, store=store) == 0
+    assert sorted(ctags[-1]) == sorted([files[1], files[2]])
+    assert _tags(tags) == [['alpha', files[0]], ['bravo', files[1]], ['echo', files[2]]]
+    # 没有留下临时文件
+    assert not [p for p in os.listdir(str(tmp_path)) if p.startswith('.')]
+    if store:
+        assert not os.path.exists(state)
+        store.close()
+
+
+def test_sharded_build(tmp_path, ctags):
+    files = []
+    for i in range(250):
+        path = tmp_path / ('f%03d.c' % i)
+        path.write_text('n%03d' % i)
+        files.append(str(path))
+    tags = str(tmp_path / 'tags')
+    assert tagbuild.build_tags(files, tags, jobs=3) == 0
+    assert len(ctags) == 2
+    assert _tags(tags) == [['n%03d' % i, files[i]] for i in range(250)]
+    assert sorted(p for p in os.listdir(str(tmp_path)) if not p.endswith('.c')) == ['bin', 'tags']
@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+
+import os
+import tempfile
+import threading
+
+import pytest
+
+import fakevim
+import vimproject
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    # 项目的临时目录建在tmp_path中
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path / 'tmp'))
+    os.mkdir(str(tmp_path / 'tmp'))
+    fakevim.reset()
+    prj = vimproject.VimProject()
+    yield prj
+    prj.close()
+
+
+def _make_project(root, name, files):
+    for f in files:
+        path = root / f
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('int x;\n')
+    fname = root / (name + '.vprj')
+    fname.write_text("PATH = ['src/**']\nSUFFIX = ['.c']\nINCTAGS = 0\n")
+    return str(fname)
+
+
+def test_files_survive_reload(tmp_path, project):
+    fname = _make_project(tmp_path / 'a', 'a', ['src/a.c', 'src/sub/b.c', 'src/x.txt'])
+    project.from_file(fname)
+    project.refresh_files()
+    expected = sorted(str(tmp_path / 'a' / f) for f in ('src/a.c', 'src/sub/b.c'))
+    assert sorted(project.files) == expected
+
+    other = vimproject.VimProject()
+    other.from_file(fname)
+    try:
+        assert sorted(other.files) == expected
+    finally:
+        other.close()
+
+
+def test_files_changed(tmp_path, project):
+    root = tmp_path / 'a'
+    project.from_file(_make_project(root, 'a', ['src/a.c', 'src/sub/b.c', 'src/sub/c.c']))
+    project.refresh_files()
+    project.on_files_changed([str(root / 'src/new.c')], [str(root / 'src/a.c')], [str(root / 'src/sub')])
+    assert sorted(project.files) == [str(root / 'src/new.c')]
+    assert project.state.files() == [str(root / 'src/new.c')]
+
+
+def test_switch_project_waits_for_update(tmp_path, project, monkeypatch):
+    fname_a = _make_project(tmp_path / 'a', 'a', ['src/a.c'])
+    fname_b = _make_project(tmp_path / 'b', 'b', ['src/b.c'])
+    project.from_file(fname_a)
+    started = threading.Event()
+    search_files = project.search_files
+
+    def slow_search():
+        files = list(search_files())
+        started.set()
+        threading.Event().wait(0.3)
+        return files
+
+    monkeypatch.setattr(project, 'search_files', slow_search)
+    monkeypatch.setattr(project, 'refresh_tags', lambda: None)
+    project.update()
+    assert started.wait(5)
+    # 正在更新项目a时切换到项目b，更新必须在设置替换之前结束
+    project.from_file(fname_b)
+    project.wait_update()
+    assert not any(f.startswith(str(tmp_path / 'a')) for f in project.files)
+    tmpdir = tmp_path / 'tmp'
+    assert [d for d in os.listdir(str(tmpdir)) if any(f.startswith('b.') for f in os.listdir(str(tmpdir / d)))] == \
+        [project.tempdir.name]